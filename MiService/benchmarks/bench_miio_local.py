@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# Loopback check of MiIOLocal against fake_device: concurrent cold callers share one handshake, exits 1 on failure
+#   ./bench_miio_local.py [callers,...] [rounds]
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_device import serve  # noqa: E402
+from miservice.miiolocal import MiIOLocal  # noqa: E402
+
+TOKEN = 'ff' * 16
+
+
+async def check(callers, rounds):
+    transport, device = await serve('127.0.0.1', 0, TOKEN)
+    port = transport.get_extra_info('sockname')[1]
+    client = MiIOLocal('127.0.0.1', TOKEN, port, timeout=1, retries=2)
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*[client.miot_get_props(1, [(2, 1)]) for _ in range(callers)], return_exceptions=True)
+        cold = time.perf_counter() - start
+        for _ in range(rounds):
+            results += await asyncio.gather(*[client.miot_get_props(1, [(2, 1)]) for _ in range(callers)], return_exceptions=True)
+        elapsed = time.perf_counter() - start
+    finally:
+        client.close()
+        transport.close()
+    errors = [r for r in results if r != [50]]
+    ok = not errors and device.hellos == 1
+    print(f"{callers:>7} {len(results):>6} {device.hellos:>6} {cold * 1000:>8.1f} {len(results) / elapsed:>8.0f} {len(errors):>6}" + ('' if ok else f"  FAIL {errors[:1]}"))
+    return ok
+
+
+async def main(counts, rounds):
+    print(f"{'callers':>7} {'calls':>6} {'hellos':>6} {'cold ms':>8} {'calls/s':>8} {'errors':>6}")
+    return all([await check(callers, rounds) for callers in counts])
+
+
+if __name__ == '__main__':
+    counts = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1, 2, 4, 16, 64]
+    sys.exit(0 if asyncio.run(main(counts, int(sys.argv[2]) if len(sys.argv) > 2 else 10)) else 1)
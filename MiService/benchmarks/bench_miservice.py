@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Offline MiService benchmark against fake_cloud: requests/sec, p50/p99 latency and login count
+#   ./bench_miservice.py [devices,...] [latency_ms]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_cloud import FakeCloud  # noqa: E402
+from miservice import MiAccount, MiIOService, MiNAService, create_session  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0
+
+
+async def timed(latencies, aw):
+    start = time.perf_counter()
+    result = await aw
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+async def run_scenario(name, cloud, devices, make_calls):
+    logins = cloud.counts['login']
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[timed(latencies, call) for call in make_calls()])
+    elapsed = time.perf_counter() - start
+    requests = len(latencies)
+    print(f"{name:<28} {devices:>5} {requests:>6} {requests / elapsed:>9.0f} {percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f} {cloud.counts['login'] - logins:>6}")
+
+
+async def bench(devices, latency):
+    cloud = FakeCloud(devices, latency)
+    await cloud.start()
+    token_path = os.path.join(tempfile.mkdtemp(), '.mi.token')
+    async with create_session() as session:
+        account = MiAccount(session, cloud.username, 'pass', token_path)
+        io_service, na_service = MiIOService(account), MiNAService(account, roster_path=token_path + '.mina')
+        cloud.attach(account, io_service, na_service)
+        dids = [d['did'] for d in cloud.devices]
+
+        await run_scenario('cold login + prop/get', cloud, devices, lambda: [io_service.miot_get_props(did, [(2, 1)]) for did in dids])
+        await run_scenario('miot_get_props per device', cloud, devices, lambda: [io_service.miot_get_props(did, [(2, 1), (2, 2)]) for did in dids])
+        await run_scenario('miot_get_props_many', cloud, devices, lambda: [io_service.miot_get_props_many({did: [(2, 1), (2, 2)] for did in dids})])
+        await run_scenario('miot_set_props per device', cloud, devices, lambda: [io_service.miot_set_props(did, [(2, 1, 30)]) for did in dids])
+        await run_scenario('home_get_props per device', cloud, devices, lambda: [io_service.home_get_props(did, ['power']) for did in dids])
+        await run_scenario('device_list', cloud, devices, lambda: [io_service.device_list()])
+        await run_scenario('mina cold login + devices', cloud, devices, lambda: [na_service.devices()])
+        speakers = await na_service.devices()
+        await run_scenario('mina broadcast', cloud, devices, lambda: [na_service.broadcast(speakers, 'Hello', 30)])
+        await run_scenario('mina text_to_speech', cloud, devices, lambda: [na_service.text_to_speech(s['deviceID'], 'Hello') for s in speakers])
+    await cloud.stop()
+
+
+async def main(device_counts, latency):
+    print(f"{'scenario':<28} {'devs':>5} {'calls':>6} {'calls/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'logins':>6}")
+    for devices in device_counts:
+        await bench(devices, latency)
+
+
+if __name__ == '__main__':
+    counts = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1, 10, 100, 1000]
+    asyncio.run(main(counts, float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0))
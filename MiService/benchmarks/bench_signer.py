@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Microbenchmark: legacy MiIOService.sign_data vs the cached-key MiSigner
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import timeit
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from miservice.miioservice import MiSigner  # noqa: E402
+
+
+def legacy_sign_nonce(ssecurity, nonce):
+    m = hashlib.sha256()
+    m.update(base64.b64decode(ssecurity))
+    m.update(base64.b64decode(nonce))
+    return base64.b64encode(m.digest()).decode()
+
+
+def legacy_sign_data(uri, data, ssecurity):
+    if not isinstance(data, str):
+        data = json.dumps(data)
+    nonce = base64.b64encode(os.urandom(8) + int(time.time() / 60).to_bytes(4, 'big')).decode()
+    snonce = legacy_sign_nonce(ssecurity, nonce)
+    msg = '&'.join([uri, snonce, nonce, 'data=' + data])
+    sign = hmac.new(key=base64.b64decode(snonce), msg=msg.encode(), digestmod=hashlib.sha256).digest()
+    return {'_nonce': nonce, 'data': data, 'signature': base64.b64encode(sign).decode()}
+
+
+def main(number=20000):
+    ssecurity = base64.b64encode(os.urandom(16)).decode()
+    uri = '/miotspec/prop/get'
+    data = {'params': [{'did': '267090026', 'siid': 2, 'piid': i} for i in range(1, 5)]}
+    payload = json.dumps(data).encode()
+
+    with mock.patch('os.urandom', return_value=bytes(8)):
+        assert legacy_sign_data(uri, data, ssecurity) == MiSigner(ssecurity).sign(uri, data), "Signature mismatch"
+
+    signer = MiSigner(ssecurity)
+    cases = [
+        ('legacy sign_data(dict)', lambda: legacy_sign_data(uri, data, ssecurity)),
+        ('MiSigner.sign(dict)', lambda: signer.sign(uri, data)),
+        ('MiSigner.sign(bytes)', lambda: signer.sign(uri, payload)),
+    ]
+    base = None
+    for name, func in cases:
+        elapsed = min(timeit.repeat(func, number=number, repeat=5))
+        us = elapsed / number * 1e6
+        base = base or us
+        print(f"{name:<24} {us:7.2f} us/op  {base / us:5.2f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Startup-time budget for micli offline commands, exits 1 when over budget, e.g.
+#   ./bench_startup.py [budget_ms] [runs]
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY = ('aiohttp', 'asyncio')  # Must not be imported by offline commands
+sys.path.insert(0, ROOT)
+
+
+def run(args, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def importtime(args):
+    # -X importtime lines: "import time: self | cumulative | name", top level modules are not indented
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules, top = set(), {}
+    for line in proc.stderr.splitlines():
+        fields = line[len('import time:'):].split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            name = fields[2].rstrip()
+            modules.add(name.strip())
+            if not name.startswith('  '):
+                top[name.strip()] = int(fields[1]) / 1000
+    return modules, top
+
+
+def sample_record():
+    # Valid [ssecurity, nonce, data] so the decode runs end to end
+    from Crypto.Cipher import ARC4
+    from miservice.miiodecode import miot_key
+    ssecurity, nonce = base64.b64encode(bytes(16)).decode(), base64.b64encode(bytes(12)).decode()
+    data = ARC4.new(miot_key(ssecurity, nonce), drop=1024).encrypt(b'{"code": 0}')
+    return [ssecurity, nonce, base64.b64encode(data).decode()]
+
+
+def main(budget, runs):
+    record = sample_record()
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+        f.write(json.dumps(record) + '\n')
+    commands = {
+        'python -c pass': ['-c', 'pass'],
+        'import miservice': ['-c', 'import miservice'],
+        'micli (help)': ['micli.py'],
+        'micli decode': ['micli.py', 'decode'] + record,
+        'micli decode (bulk)': ['micli.py', 'decode', f.name, '1'],
+    }
+    failed = False
+    baseline = run(commands['python -c pass'], runs)
+    print(f"{'command':<20} {'wall ms':>8} {'startup ms':>11} {'top imports (cumulative ms)'}")
+    for name, args in commands.items():
+        elapsed = run(args, runs)
+        modules, top = importtime(args)
+        top = sorted(top.items(), key=lambda m: -m[1])[:3]
+        heavy = [m for m in HEAVY if m in modules] if name.startswith('micli') else []
+        over = name.startswith('micli') and (elapsed - baseline) * 1000 > budget
+        failed = failed or over or bool(heavy)
+        print(f"{name:<20} {elapsed * 1000:>8.1f} {(elapsed - baseline) * 1000:>11.1f} {', '.join(f'{m} {t:.1f}' for m, t in top)}"
+              + (' OVER BUDGET' if over else '') + (f" imports {', '.join(heavy)}" if heavy else ''))
+    os.remove(f.name)
+    return failed
+
+
+if __name__ == '__main__':
+    argv = sys.argv + [None] * 2
+    sys.exit(1 if main(float(argv[1] or 100), int(argv[2] or 5)) else 0)
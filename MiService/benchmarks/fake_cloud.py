@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# In-process stand-in for the Xiaomi cloud: account login, signed api.io.mi.com/app and api2.mina.mi.com, e.g.
+#   ./fake_cloud.py 8088 100   # then point MiAccount.server, MiIOService.server and MiNAService.server at it
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+from collections import Counter
+from aiohttp import web
+
+PREFIX = '&&&START&&&'  # Stripped by MiAccount._serviceLogin
+
+
+class FakeCloud:
+
+    def __init__(self, devices=10, latency=0, username='user', password='pass'):
+        self.latency = latency  # Simulated server time per request
+        self.username = username
+        self.password_hash = hashlib.md5(password.encode()).hexdigest().upper()
+        self.devices = [{'did': str(100000 + i), 'name': f'Device {i}', 'model': 'xiaomi.wifispeaker.lx04', 'token': os.urandom(16).hex(), 'localip': f'10.0.{i // 250}.{i % 250 + 2}', 'mac': f'AA:BB:CC:00:{i // 256:02X}:{i % 256:02X}'} for i in range(devices)]
+        self.props = {}  # (did, siid, piid) -> value
+        self.pass_tokens = set()
+        self.service_tokens = {}  # serviceToken -> ssecurity
+        self.nonces = {}  # nonce -> ssecurity, pending security token fetches
+        self.counts = Counter()
+        self.base = None
+        self.app = web.Application()
+        self.app.router.add_route('*', '/pass/serviceLogin', self.service_login)
+        self.app.router.add_post('/pass/serviceLoginAuth2', self.service_login_auth2)
+        self.app.router.add_get('/sts', self.security_token)
+        self.app.router.add_post('/app/{uri:.*}', self.miio)
+        self.app.router.add_get('/mina/admin/v2/device_list', self.mina_device_list)
+        self.app.router.add_post('/mina/remote/ubus', self.mina_ubus)
+        self.runner = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base = f'http://{host}:{port}'
+        return self.base
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def attach(self, account, io_service=None, na_service=None):
+        account.server = self.base + '/pass/'
+        if io_service:
+            io_service.server = self.base + '/app'
+        if na_service:
+            na_service.server = self.base + '/mina'
+
+    async def _delay(self, name):
+        self.counts[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _login_ok(self, sid):
+        ssecurity = base64.b64encode(os.urandom(16)).decode()
+        nonce = int.from_bytes(os.urandom(6), 'big')
+        pass_token = base64.b64encode(os.urandom(12)).decode()
+        self.pass_tokens.add(pass_token)
+        self.nonces[str(nonce)] = ssecurity
+        return {'code': 0, 'userId': 1000, 'passToken': pass_token, 'ssecurity': ssecurity, 'nonce': nonce, 'location': f'{self.base}/sts?sid={sid}&nonce={nonce}'}
+
+    def _pass(self, resp):
+        return web.Response(text=PREFIX + json.dumps(resp))
+
+    async def service_login(self, request):
+        await self._delay('serviceLogin')
+        sid = request.query.get('sid')
+        if request.cookies.get('passToken') in self.pass_tokens:
+            self.counts['login'] += 1
+            return self._pass(self._login_ok(sid))
+        return self._pass({'code': 70016, 'qs': '%3Fsid%3D' + sid, 'sid': sid, '_sign': 'sign', 'callback': 'https://sts.api.io.mi.com/sts'})
+
+    async def service_login_auth2(self, request):
+        await self._delay('serviceLoginAuth2')
+        data = await request.post()
+        if data.get('user') != self.username or data.get('hash') != self.password_hash:
+            return self._pass({'code': 70016, 'desc': 'Wrong password'})
+        self.counts['login'] += 1
+        return self._pass(self._login_ok(data['sid']))
+
+    async def security_token(self, request):
+        await self._delay('securityTokenService')
+        nonce = request.query['nonce']
+        ssecurity = self.nonces.pop(nonce, None)
+        expected = base64.b64encode(hashlib.sha1(f'nonce={nonce}&{ssecurity}'.encode()).digest()).decode()
+        if ssecurity is None or request.query.get('clientSign') != expected:
+            return web.Response(status=403, text='Invalid clientSign')
+        service_token = base64.b64encode(os.urandom(24)).decode()
+        self.service_tokens[service_token] = ssecurity
+        response = web.Response(text='ok')
+        response.set_cookie('serviceToken', service_token)
+        return response
+
+    def _authorized(self, request):
+        return self.service_tokens.get(request.cookies.get('serviceToken'))
+
+    async def miio(self, request):
+        uri = '/' + request.match_info['uri']
+        await self._delay(uri.split('/rpc/')[0])
+        ssecurity = self._authorized(request)
+        if not ssecurity:
+            return web.Response(status=401, text='Unauthorized')
+        form = await request.post()
+        nonce, data = form['_nonce'], form['data']
+        snonce = hashlib.sha256(base64.b64decode(ssecurity) + base64.b64decode(nonce)).digest()
+        msg = '&'.join([uri, base64.b64encode(snonce).decode(), nonce, 'data=' + data])
+        if base64.b64encode(hmac.new(snonce, msg.encode(), hashlib.sha256).digest()).decode() != form['signature']:
+            return web.json_response({'code': -8, 'message': 'Invalid signature'})
+        return web.json_response({'code': 0, 'message': 'ok', 'result': self.miio_result(uri, json.loads(data))})
+
+    def miio_result(self, uri, data):
+        if uri == '/miotspec/prop/get':
+            return [dict(p, code=0, value=self.props.get((p['did'], p['siid'], p['piid']), p['siid'] * 10 + p['piid'])) for p in data['params']]
+        if uri == '/miotspec/prop/set':
+            result = []
+            for p in data['params']:
+                self.props[(p['did'], p['siid'], p['piid'])] = p['value']
+                result.append({'did': p['did'], 'siid': p['siid'], 'piid': p['piid'], 'code': 0})
+            return result
+        if uri == '/miotspec/action':
+            return dict(data['params'], code=0, out=[])
+        if uri == '/home/device_list':
+            return {'list': self.devices}
+        if uri.startswith('/home/rpc/'):
+            did = uri[10:]
+            if data['method'] == 'get_prop':
+                return [self.props.get((did, p), 0) for p in data['params']]
+            self.props[(did, data['method'][4:])] = data['params'][0] if data['params'] else None
+            return ['ok']
+        return None
+
+    async def mina_device_list(self, request):
+        await self._delay('/admin/v2/device_list')
+        if not self._authorized(request):
+            return web.Response(status=401, text='Unauthorized')
+        return web.json_response({'code': 0, 'data': [{'deviceID': d['did'], 'name': d['name'], 'hardware': 'LX04', 'capabilities': {'yunduantts': 1}} for d in self.devices]})
+
+    async def mina_ubus(self, request):
+        await self._delay('/remote/ubus')
+        if not self._authorized(request):
+            return web.Response(status=401, text='Unauthorized')
+        form = await request.post()
+        json.loads(form['message'])
+        return web.json_response({'code': 0, 'message': 'Success', 'data': {'code': 0, 'info': '', 'method': form['method']}})
+
+
+async def main(port, devices):
+    cloud = FakeCloud(devices)
+    print(f"Fake Xiaomi cloud with {devices} devices on {await cloud.start(port=port)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await cloud.stop()
+
+
+if __name__ == '__main__':
+    argv = sys.argv + [None] * 2
+    asyncio.run(main(int(argv[1] or 8088), int(argv[2] or 10)))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Fake miIO device on UDP for exercising MiIOLocal offline, e.g.
+#   ./fake_device.py 127.0.0.1 54321 ffffffffffffffffffffffffffffffff
+import asyncio
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from miservice.miiolocal import MIIO_PORT, MiIOCodec  # noqa: E402
+
+
+class FakeMiIODevice(asyncio.DatagramProtocol):
+
+    def __init__(self, token, device_id=0x08f83588, props=None, drop=0, drop_replies=0):
+        self.codec = MiIOCodec(token)
+        self.device_id = device_id
+        self.props = props if props is not None else {(2, 1): 50, (2, 2): False}
+        self.drop = drop  # Drop the first N requests to exercise retries
+        self.drop_replies = drop_replies  # Execute but drop the replies of the next N requests
+        self.actions = 0
+        self.requests = 0
+        self.hellos = 0
+        self.start = time.monotonic()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        stamp = int(time.monotonic() - self.start) + 1000
+        if len(data) == 32:  # Hello
+            self.hellos += 1
+            self.transport.sendto(struct.pack('>HHIII', 0x2131, 32, 0, self.device_id, stamp) + self.codec.token, addr)
+            return
+        self.requests += 1
+        if self.drop > 0:
+            self.drop -= 1
+            return
+        _, _, request = self.codec.decode(data)
+        response = self.handle(request)
+        if self.drop_replies > 0:
+            self.drop_replies -= 1
+            return
+        self.transport.sendto(self.codec.encode(self.device_id, stamp, response), addr)
+
+    def handle(self, request):
+        method, params = request['method'], request['params']
+        if method == 'get_properties':
+            result = [dict(p, code=0, value=self.props[(p['siid'], p['piid'])]) if (p['siid'], p['piid']) in self.props else dict(p, code=-4003) for p in params]
+        elif method == 'set_properties':
+            result = []
+            for p in params:
+                self.props[(p['siid'], p['piid'])] = p['value']
+                result.append({'did': p['did'], 'siid': p['siid'], 'piid': p['piid'], 'code': 0})
+        elif method == 'action':
+            self.actions += 1
+            result = {'did': params['did'], 'siid': params['siid'], 'aiid': params['aiid'], 'code': 0, 'out': []}
+        else:
+            return {'id': request['id'], 'error': {'code': -32601, 'message': 'Method not found'}}
+        return {'id': request['id'], 'result': result}
+
+
+async def serve(host='127.0.0.1', port=MIIO_PORT, token='ff' * 16, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.create_datagram_endpoint(lambda: FakeMiIODevice(token, **kwargs), local_addr=(host, port))
+
+
+async def main(host, port, token):
+    transport, device = await serve(host, port, token)
+    print(f"Fake miIO device {device.device_id:08x} on {host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    argv = sys.argv + [None] * 3
+    asyncio.run(main(argv[1] or '127.0.0.1', int(argv[2] or MIIO_PORT), argv[3] or 'ff' * 16))
@@ -1,60 +1,237 @@
 #!/usr/bin/env python3
-from aiohttp import ClientSession
-import asyncio
-import logging
 import json
 import os
 import sys
-from pathlib import Path
 
-from miservice import MiAccount, MiNAService, MiIOService, miio_command, miio_command_help
+# miservice is imported where needed, so help and offline decode start without asyncio/aiohttp
 
 MISERVICE_VERSION = '2.1.2'
 
 def usage():
+    from miservice import miio_command_help
     print("MiService %s - XiaoMi Cloud Service\n" % MISERVICE_VERSION)
     print("Usage: The following variables must be set:")
     print("           export MI_USER=<Username>")
     print("           export MI_PASS=<Password>")
     print("           export MI_DID=<Device ID|Name>\n")
     print(miio_command_help(prefix=sys.argv[0] + ' '))
+    print("Run Daemon: %sserve\n           Keep login and session warm, later commands are forwarded to $MI_SOCKET (~/.mi.sock)\n" % (sys.argv[0] + ' '))
+    print("Run Batch: %sbatch <file|-> [concurrency=8]\n           One command per line, or <Device ID|Name><TAB><command>, results as JSON Lines in input order\n" % (sys.argv[0] + ' '))
+    print("Stats: %sstats\n           Request latency histograms and counters of the daemon in Prometheus text format\n" % (sys.argv[0] + ' '))
+
+
+def setup_logging(verbose):
+    # -v[0-5]: NOTSET (no handler), FATAL, ERROR, WARN, INFO (default -v), DEBUG; WARNING without -v
+    import logging
+    if verbose:
+        level = [logging.NOTSET, logging.FATAL, logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG][int(verbose[2]) if len(verbose) > 2 else 4]
+    else:
+        level = logging.WARNING
+    if level != logging.NOTSET:
+        _LOGGER = logging.getLogger('miservice')
+        _LOGGER.setLevel(level)
+        _LOGGER.addHandler(logging.StreamHandler())
+
+
+def socket_path():
+    return os.environ.get('MI_SOCKET') or os.path.expanduser('~/.mi.sock')
+
+
+def make_services(session, refresh_after=None):
+    # Background token refresh only for callers that keep the session open: serve and batch
+    from miservice import MiAccount, MiNAService, MiIOService, MiMetrics, MiTracer
+    env_get = os.environ.get
+    store = os.path.expanduser('~/.mi.token')
+    metrics = MiMetrics()
+    account = MiAccount(session, env_get('MI_USER'), env_get('MI_PASS'), store, refresh_after, tracer=MiTracer(metrics))
+    return MiIOService(account), MiNAService(account), metrics
+
+
+async def run_command(services, args, did, prefix):
+    from miservice import miio_command
+    if args == 'stats':
+        result = services[2].export()
+    elif args.startswith('mina'):
+        service = services[1]
+        result = await service.devices()
+        if len(args) > 4:
+            result = await service.broadcast(result, args[4:])
+    else:
+        result = await miio_command(services[0], did, args, prefix)
+    return result
+
+
+def format_result(result):
+    return result if isinstance(result, str) else json.dumps(result, indent=2, ensure_ascii=False)
 
 
 async def main(args):
+    from miservice import create_session
     try:
-        env_get = os.environ.get
-        store = os.path.join(str(Path.home()), '.mi.token')
-        async with ClientSession() as session:
-            account = MiAccount(session, env_get('MI_USER'), env_get('MI_PASS'), store)
-            if args.startswith('mina'):
-                service = MiNAService(account)
-                result = await service.device_list()
-                if len(args) > 4:
-                    await service.send_message(result, -1, args[4:])
-            else:
-                service = MiIOService(account)
-                result = await miio_command(service, env_get('MI_DID'), args, sys.argv[0] + ' ')
-            if not isinstance(result, str):
-                result = json.dumps(result, indent=2, ensure_ascii=False)
+        async with create_session() as session:
+            result = format_result(await run_command(make_services(session), args, os.environ.get('MI_DID'), sys.argv[0] + ' '))
     except Exception as e:
         result = e
     print(result)
 
+
+def daemon_alive(path):
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1)
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+async def serve(path):
+    import asyncio
+    from miservice import create_session
+    if daemon_alive(path):
+        sys.exit("Another daemon is serving on %s" % path)
+    async with create_session() as session:
+        services = make_services(session, 3 * 3600)
+        await services[0].account.login_all(['xiaomiio', 'micoapi'])
+
+        async def handle(reader, writer):
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    request = json.loads(line)
+                    try:
+                        response = {'result': await run_command(services, request['args'], request.get('did'), request.get('prefix', ''))}
+                    except Exception as e:
+                        response = {'error': str(e)}
+                    writer.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+                    await writer.drain()
+            finally:
+                writer.close()
+
+        if os.path.exists(path):
+            os.remove(path)  # Stale, nobody is listening
+        server = await asyncio.start_unix_server(handle, path)
+        os.chmod(path, 0o600)
+        inode = os.stat(path).st_ino
+        print("MiService %s serving on %s" % (MISERVICE_VERSION, path))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(path) and os.stat(path).st_ino == inode:  # Still ours
+                os.remove(path)
+
+
+async def batch(path, concurrency=8):
+    # Many commands over one session, results printed in input order as they become ready
+    import asyncio
+    import time
+    from miservice import create_session
+    with (sys.stdin if path == '-' else open(path)) as f:
+        lines = [line.strip() for line in f]
+    did = os.environ.get('MI_DID')
+    jobs = [[part.strip() for part in line.split('\t', 1)] if '\t' in line else (did, line) for line in lines if line and not line.startswith('#')]
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    errors = 0
+
+    async def run(services, did, args):
+        async with semaphore:
+            try:
+                return {'result': await run_command(services, args, did, sys.argv[0] + ' ')}
+            except Exception as e:
+                return {'error': str(e)}
+
+    async with create_session() as session:
+        services = make_services(session, 3 * 3600)
+        tasks = [asyncio.ensure_future(run(services, did, args)) for did, args in jobs]
+        for (did, args), task in zip(jobs, tasks):
+            response = await task
+            errors += 'error' in response
+            print(json.dumps({'did': did, 'args': args, **response}, ensure_ascii=False, default=str), flush=True)
+        await services[0].account.drain()
+    print("Ran %d commands (%d errors) in %.2fs" % (len(jobs), errors, time.perf_counter() - start), file=sys.stderr)
+
+
+def decode(path, workers=None):
+    # Bulk decode a capture file locally, one JSON line per record in input order
+    import time
+    from miservice.miiodecode import miot_capture, miot_decode_many
+    start = time.perf_counter()
+    count = errors = 0
+    with (sys.stdin if path == '-' else open(path)) as f:
+        for result in miot_decode_many(miot_capture(f), workers):
+            count += 1
+            if isinstance(result, Exception):
+                errors += 1
+                result = {'error': str(result)}
+            print(json.dumps(result, ensure_ascii=False))
+    elapsed = time.perf_counter() - start
+    print("Decoded %d records (%d errors) in %.2fs, %.0f records/s" % (count, errors, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+
+
+def forward(path, args, timeout=120):
+    # Thin client: one JSON line request/response over the daemon socket, None when no daemon answered
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1)
+        try:
+            sock.connect(path)
+        except OSError:
+            return None  # Stale socket
+        sock.settimeout(timeout)
+        request = {'args': args, 'did': os.environ.get('MI_DID'), 'prefix': sys.argv[0] + ' '}
+        try:
+            sock.sendall(json.dumps(request, ensure_ascii=False).encode() + b'\n')
+            with sock.makefile('rb') as f:
+                response = json.loads(f.readline())
+        except socket.timeout:
+            return "Timeout waiting for the daemon on %s" % path  # It may still run the command, don't repeat it
+        except (OSError, ValueError):
+            return None  # Daemon died without a reply
+    return response['error'] if 'error' in response else format_result(response['result'])
+
 if __name__ == '__main__':
     argv = sys.argv
     argc = len(argv)
-    if argc > 1 and argv[1].startswith('-v'):
-        argi = 2
-        index = int(argv[1][2]) if len(argv[1]) > 2 else 4
-        level = [logging.NOTSET, logging.FATAL, logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG][index]
-    else:
-        argi = 1
-        level = logging.WARNING
+    verbose = argv[1] if argc > 1 and argv[1].startswith('-v') else None
+    argi = 2 if verbose else 1
     if argc > argi:
-        if level != logging.NOTSET:
-            _LOGGER = logging.getLogger('miservice')
-            _LOGGER.setLevel(level)
-            _LOGGER.addHandler(logging.StreamHandler())
-        asyncio.run(main(' '.join(argv[argi:])))
+        args = ' '.join(argv[argi:])
+        if argv[argi] == 'decode' and 1 < argc - argi <= 3:
+            decode(argv[argi + 1], int(argv[argi + 2]) if argc - argi > 2 else None)
+        elif argv[argi] == 'decode' and 4 <= argc - argi <= 5:
+            from miservice.miiodecode import miot_decode
+            try:
+                result = format_result(miot_decode(*argv[argi + 1:argi + 4], argc - argi > 4 and argv[argi + 4] == 'gzip'))
+            except Exception as e:
+                result = e
+            print(result)
+        else:
+            setup_logging(verbose)
+            path = socket_path()
+            if argv[argi] == 'batch' and 1 < argc - argi <= 3:
+                import asyncio
+                asyncio.run(batch(argv[argi + 1], int(argv[argi + 2]) if argc - argi > 2 else 8))
+            elif args == 'serve':
+                import asyncio
+                try:
+                    asyncio.run(serve(path))
+                except KeyboardInterrupt:
+                    pass
+            else:
+                result = None
+                if os.path.exists(path):
+                    result = forward(path, args)
+                if result is None and args == 'stats':
+                    sys.exit("No daemon on %s, stats are collected by '%sserve'" % (path, sys.argv[0] + ' '))
+                if result is None:
+                    import asyncio
+                    asyncio.run(main(args))
+                else:
+                    print(result)
     else:
         usage()
@@ -1,5 +1,35 @@
-from .miaccount import MiAccount, MiTokenStore
-from .minaservice import MiNAService
-from .miioservice import MiIOService
-from .miiocommand import miio_command, miio_command_help
+import importlib
 
+# Submodules load on first attribute access, so offline commands never pull in aiohttp
+_LAZY = {
+    'MiAccount': 'miaccount', 'MiTokenStore': 'miaccount',
+    'MiNAService': 'minaservice',
+    'MiIOService': 'miioservice', 'MiSigner': 'miioservice',
+    'MiSpecCache': 'mispec',
+    'MiIOCache': 'miiocache',
+    'MiIODeviceRegistry': 'miiodevices',
+    'MiIOCodec': 'miiolocal', 'MiIOLocal': 'miiolocal',
+    'miot_decode': 'miiodecode', 'miot_decode_many': 'miiodecode',
+    'MiIORouter': 'miiorouter',
+    'MiIOPoller': 'miiopoller',
+    'MiRateLimiter': 'mipolicy', 'MiRetryPolicy': 'mipolicy', 'TokenBucket': 'mipolicy',
+    'MiMetrics': 'mitrace', 'MiTracer': 'mitrace',
+    'MiotModel': 'miotmodel', 'MiotRegistry': 'miotmodel',
+    'MiConnector': 'misession', 'create_session': 'misession', 'session_stats': 'misession',
+    'miio_command': 'miiocommand', 'miio_command_help': 'miiocommand',
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import hashlib
 import json
@@ -5,9 +6,14 @@ import logging
 import os
 import random
 import string
+import time
 from urllib import parse
-from aiohttp import ClientSession
-from aiofiles import open as async_open
+from aiohttp import ClientError, ClientSession
+from .mifile import write_atomic
+try:
+    import fcntl
+except ImportError:  # Windows, no inter-process locking
+    fcntl = None
 
 _LOGGER = logging.getLogger(__package__)
 
@@ -16,45 +22,169 @@ def get_random(length):
     return ''.join(random.sample(string.ascii_letters + string.digits, length))
 
 
+async def limited_gather(aws, limit=None):
+    if not limit:
+        return await asyncio.gather(*aws)
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+    return await asyncio.gather(*[run(aw) for aw in aws])
+
+
 class MiTokenStore:
 
     def __init__(self, token_path):
         self.token_path = token_path
+        self._token = None  # Authoritative in-memory copy
+        self._data = None  # Serialized form of the last token read or written
+        self._mtime = None
+
+    def _lock(self, exclusive):
+        if fcntl is None:
+            return None
+        f = open(self.token_path + '.lock', 'a')
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return f
+
+    def _read(self):
+        lock = self._lock(False)
+        try:
+            mtime = os.stat(self.token_path).st_mtime_ns
+            if mtime != self._mtime:  # First load or updated by another process
+                with open(self.token_path) as f:
+                    self._data = f.read()
+                self._token = json.loads(self._data)
+                self._mtime = mtime
+        except FileNotFoundError:
+            pass
+        finally:
+            if lock:
+                lock.close()
+        return self._token
+
+    def _write(self, data):
+        lock = self._lock(True)
+        try:
+            write_atomic(self.token_path, data)
+            self._mtime = os.stat(self.token_path).st_mtime_ns
+        finally:
+            if lock:
+                lock.close()
+
+    def _remove(self):
+        lock = self._lock(True)
+        try:
+            if os.path.isfile(self.token_path):
+                os.remove(self.token_path)
+            self._mtime = None
+        finally:
+            if lock:
+                lock.close()
 
     async def load_token(self):
-        if os.path.isfile(self.token_path):
-            try:
-                async with async_open(self.token_path) as f:                    
-                    return json.loads(await f.read())
-            except Exception as e:
-                _LOGGER.exception("Exception on load token from %s: %s", self.token_path, e)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self._read)
+        except Exception as e:
+            _LOGGER.exception("Exception on load token from %s: %s", self.token_path, e)
         return None
 
     async def save_token(self, token=None):
+        loop = asyncio.get_running_loop()
         if token:
+            data = json.dumps(token, indent=2)
+            if data == self._data:
+                return
+            self._token, self._data = token, data
             try:
-                async with async_open(self.token_path, 'w') as f:
-                    await f.write(json.dumps(token, indent=2))
+                await loop.run_in_executor(None, self._write, data)
             except Exception as e:
                 _LOGGER.exception("Exception on save token to %s: %s", self.token_path, e)
-        elif os.path.isfile(self.token_path):
-            os.remove(self.token_path)
+        else:
+            self._token = self._data = None
+            await loop.run_in_executor(None, self._remove)
 
 
 class MiAccount:
 
-    def __init__(self, session: ClientSession, username, password, token_store='.mi.token'):
+    def __init__(self, session: ClientSession, username, password, token_store='.mi.token', refresh_after=None, limiter=None, retry=None, tracer=None):
         self.session = session
         self.username = username
         self.password = password
         self.token_store = MiTokenStore(token_store) if isinstance(token_store, str) else token_store
         self.token = None
+        self.refresh_after = refresh_after  # Seconds before a serviceToken is refreshed in background, opt-in: the session must outlive it (drain())
+        self.limiter = limiter  # MiRateLimiter
+        self.retry = retry  # MiRetryPolicy, for idempotent requests
+        self.tracer = tracer  # MiTracer
+        self.server = 'https://account.xiaomi.com/pass/'
+        self._logins = {}
+
+    def _start_login(self, sid, refresh=False, on_pass=None):
+        # Single-flight: concurrent callers for the same sid share one login
+        task = self._logins.get(sid)
+        if task is None:
+            task = asyncio.ensure_future(self._login(sid, refresh, on_pass))
+            self._logins[sid] = task
+            task.add_done_callback(lambda _: self._logins.pop(sid, None))
+        return task
 
     async def login(self, sid):
-        if not self.token:
-            self.token = {'deviceId': get_random(16).upper()}
+        return await asyncio.shield(self._start_login(sid))
+
+    async def login_all(self, sids, force=False):
+        # One login establishes the passToken, the other sids reuse it concurrently as soon as it is known
+        if self.token is None and self.token_store is not None:
+            self.token = await self.token_store.load_token()
+        sids = [sid for sid in sids if force or not (self.token and sid in self.token)]
+        if not sids:
+            return True
+        tasks = []
+        if not (self.token and 'passToken' in self.token):
+            ready = asyncio.get_running_loop().create_future()
+            task = self._start_login(sids.pop(0), on_pass=lambda: ready.done() or ready.set_result(True))
+            await asyncio.wait([task, ready], return_when=asyncio.FIRST_COMPLETED)
+            if task.done() and not task.result():
+                return False
+            tasks.append(asyncio.shield(task))
+        return all(await asyncio.gather(*tasks, *[self.login(sid) for sid in sids]))
+
+    async def relogin(self, sid, serviceToken):
+        # Only the first caller holding the stale serviceToken logs in again, others reuse its result
+        if sid not in self._logins and self.token_store:
+            token = await self.token_store.load_token()  # May have been refreshed by another process
+            if token and sid in token:
+                self.token = token
+        if sid not in self._logins and self.token and sid in self.token and self.token[sid][1] != serviceToken:
+            return True
+        return await self.login(sid)
+
+    def token_age(self, sid):
+        service = self.token.get(sid) if self.token else None
+        return time.time() - service[2] if service and len(service) > 2 else None
+
+    def _refresh_aging(self, sid):
+        # Only for long-lived users of the session (daemon, batch), they await drain() before closing it
+        if self.refresh_after and sid not in self._logins and not self.session.closed:
+            age = self.token_age(sid)
+            if age is None:  # Saved before ages were recorded, count from now
+                self.token = dict(self.token, **{sid: (*self.token[sid][:2], int(time.time()))})
+            elif age > self.refresh_after:
+                _LOGGER.info("Refresh %s serviceToken in background, age=%s", sid, age)
+                self._start_login(sid, True)
+
+    async def drain(self):
+        # Wait for background refreshes before the session is closed
+        while self._logins:
+            await asyncio.gather(*list(self._logins.values()), return_exceptions=True)
+
+    async def _login(self, sid, refresh=False, on_pass=None):
+        # Log in on a copy and swap it in when complete, so requests keep using the current token meanwhile
+        token = dict(self.token) if self.token else {'deviceId': get_random(16).upper()}
+        start = time.perf_counter()
         try:
-            resp = await self._serviceLogin(f'serviceLogin?sid={sid}&_json=true')
+            resp = await self._serviceLogin(f'serviceLogin?sid={sid}&_json=true', None, token)
             if resp['code'] != 0:
                 data = {
                     '_json': 'true',
@@ -65,33 +195,41 @@ class MiAccount:
                     'user': self.username,
                     'hash': hashlib.md5(self.password.encode()).hexdigest().upper()
                 }
-                resp = await self._serviceLogin('serviceLoginAuth2', data)
+                resp = await self._serviceLogin('serviceLoginAuth2', data, token)
                 if resp['code'] != 0:
                     raise Exception(resp)
 
-            self.token['userId'] = resp['userId']
-            self.token['passToken'] = resp['passToken']
-
+            if on_pass:  # Publish the passToken early for logins of other sids
+                self.token = dict(self.token or token, userId=resp['userId'], passToken=resp['passToken'])
+                on_pass()
             serviceToken = await self._securityTokenService(resp['location'], resp['nonce'], resp['ssecurity'])
-            self.token[sid] = (resp['ssecurity'], serviceToken)
+            token = dict(self.token or token, userId=resp['userId'], passToken=resp['passToken'])
+            token[sid] = (resp['ssecurity'], serviceToken, int(time.time()))
+            self.token = token
             if self.token_store:
                 await self.token_store.save_token(self.token)
+            self.trace('login', sid=sid, refresh=refresh, ok=True, elapsed=time.perf_counter() - start)
             return True
 
         except Exception as e:
+            self.trace('login', sid=sid, refresh=refresh, ok=False, elapsed=time.perf_counter() - start)
+            if refresh:
+                _LOGGER.warning("Exception on refresh %s for %s: %s", sid, self.username, e)
+                return False
             self.token = None
             if self.token_store:
                 await self.token_store.save_token()
             _LOGGER.exception("Exception on login %s: %s", self.username, e)
             return False
 
-    async def _serviceLogin(self, uri, data=None):
+    async def _serviceLogin(self, uri, data=None, token=None):
+        token = token or self.token
         headers = {'User-Agent': 'APP/com.xiaomi.mihome APPV/6.0.103 iosPassportSDK/3.9.0 iOS/14.4 miHSTS'}
-        cookies = {'sdkVersion': '3.9', 'deviceId': self.token['deviceId']}
-        if 'passToken' in self.token:
-            cookies['userId'] = self.token['userId']
-            cookies['passToken'] = self.token['passToken']
-        url = 'https://account.xiaomi.com/pass/' + uri
+        cookies = {'sdkVersion': '3.9', 'deviceId': token['deviceId']}
+        if 'passToken' in token:
+            cookies['userId'] = token['userId']
+            cookies['passToken'] = token['passToken']
+        url = self.server + uri
         async with self.session.request('GET' if data is None else 'POST', url, data=data, cookies=cookies, headers=headers) as r:
             raw = await r.read()
         resp = json.loads(raw[11:])
@@ -107,29 +245,65 @@ class MiAccount:
                 raise Exception(await r.text())
         return serviceToken
 
-    async def mi_request(self, sid, url, data, headers, relogin=True):
+    def trace(self, event, **fields):
+        if self.tracer:
+            self.tracer.emit(event, **fields)
+
+    async def _request(self, sid, url, data, headers):
+        cookies = {'userId': self.token['userId'], 'serviceToken': self.token[sid][1]}
+        content = data(self.token, cookies) if callable(data) else data
+        method = 'GET' if data is None else 'POST'
+        _LOGGER.debug("%s %s", url, content)
+        async with self.session.request(method, url, data=content, cookies=cookies, headers=headers) as r:
+            status = r.status
+            raw = await r.read()
+        if status == 200:
+            start = time.perf_counter()
+            resp = json.loads(raw)
+            self.trace('decode', url=url, size=len(raw), elapsed=time.perf_counter() - start)
+            if resp['code'] != 0 and 'auth' in resp.get('message', '').lower():
+                status = 401
+        else:
+            resp = raw.decode(errors='replace')
+        return status, resp, len(raw)
+
+    async def mi_request(self, sid, url, data, headers, relogin=True, idempotent=False):
         if self.token is None and self.token_store is not None:
             self.token = await self.token_store.load_token()
         if (self.token and sid in self.token) or await self.login(sid):  # Ensure login
-            cookies = {'userId': self.token['userId'], 'serviceToken': self.token[sid][1]}
-            content = data(self.token, cookies) if callable(data) else data
-            method = 'GET' if data is None else 'POST'
-            _LOGGER.debug("%s %s", url, content)
-            async with self.session.request(method, url, data=content, cookies=cookies, headers=headers) as r:
-                status = r.status
-                if status == 200:
-                    resp = await r.json(content_type=None)
-                    code = resp['code']
-                    if code == 0:
-                        return resp
-                    if 'auth' in resp.get('message', '').lower():
-                        status = 401
+            self._refresh_aging(sid)
+            serviceToken = self.token[sid][1]
+            attempt = 0
+            start = time.perf_counter()
+            self.trace('request_start', sid=sid, url=url)
+            while True:
+                if self.limiter:
+                    await self.limiter.acquire(sid, url)
+                try:
+                    status, resp, size = await self._request(sid, url, data, headers)
+                except (ClientError, asyncio.TimeoutError) as e:
+                    if not (idempotent and self.retry and self.retry.should_retry(attempt, None)):
+                        self.trace('request_end', sid=sid, url=url, status=None, code=type(e).__name__, size=0, attempts=attempt + 1, elapsed=time.perf_counter() - start)
+                        raise
+                    status, resp = None, e
                 else:
-                    resp = await r.text()
+                    code = resp.get('code') if isinstance(resp, dict) else None
+                    ok = status == 200 and code == 0
+                    if ok or not (idempotent and self.retry and status != 401 and self.retry.should_retry(attempt, status)):
+                        self.trace('request_end', sid=sid, url=url, status=status, code=code, size=size, attempts=attempt + 1, elapsed=time.perf_counter() - start)
+                        if ok:
+                            return resp
+                        break
+                delay = self.retry.delay(attempt)
+                _LOGGER.info("Retry %s in %.2fs after %s: %s", url, delay, status, resp)
+                await asyncio.sleep(delay)
+                attempt += 1
             if status == 401 and relogin:
                 _LOGGER.warn("Auth error on request %s %s, relogin...", url, resp)
-                self.token = None  # Auth error, reset login
-                return await self.mi_request(sid, url, data, headers, False)
+                self.trace('relogin', sid=sid, url=url)
+                if await self.relogin(sid, serviceToken):
+                    return await self.mi_request(sid, url, data, headers, False, idempotent)
+                resp = "Relogin failed"
         else:
             resp = "Login failed"
         raise Exception(f"Error {url}: {resp}")
@@ -0,0 +1,23 @@
+import json
+import os
+import tempfile
+
+
+def write_atomic(path, data):
+    # Unique owner-only (0600) temp file next to path, then renamed over it: readers never see a partial file,
+    # concurrent writers never share a temp file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def write_json(path, obj, **kwargs):
+    write_atomic(path, json.dumps(obj, ensure_ascii=False, **kwargs))
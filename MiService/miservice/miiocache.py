@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+
+class MiIOCache:
+    # Opt-in read-through cache in front of MiIOService, same get/set interface
+
+    def __init__(self, service, ttl=1.0, ttls=None):
+        self.service = service
+        self.ttl = ttl
+        self.ttls = ttls or {}  # (siid, piid) or legacy prop name -> ttl
+        self.counters = dict.fromkeys(('hits', 'misses', 'coalesced', 'invalidations', 'requests', 'hit_age'), 0)
+        self._values = {}  # did -> {key: (time, value)}
+        self._inflight = {}  # (did, key) -> future
+        self._generations = {}  # did -> invalidation count, drops results of reads racing with a write
+
+    def __getattr__(self, name):
+        return getattr(self.service, name)
+
+    def invalidate(self, did=None):
+        self.counters['invalidations'] += 1
+        if did is None:
+            self._values.clear()
+            self._generations = {d: g + 1 for d, g in self._generations.items()}
+        else:
+            self._values.pop(did, None)
+            self._generations[did] = self._generations.get(did, 0) + 1
+
+    def stats(self):
+        counters = self.counters
+        reads = counters['hits'] + counters['misses'] + counters['coalesced']
+        return dict(counters, hit_ratio=(counters['hits'] + counters['coalesced']) / reads if reads else 0, avg_staleness=counters['hit_age'] / counters['hits'] if counters['hits'] else 0)
+
+    async def _get(self, did, keys, fetch):
+        counters = self.counters
+        now = time.monotonic()
+        values = self._values.get(did, {})
+        results = {}
+        waits = {}
+        futures = {}
+        for key in keys:
+            if key in results or key in waits or key in futures:
+                continue
+            entry = values.get(key)
+            if entry and now - entry[0] < self.ttls.get(key, self.ttl):
+                results[key] = entry[1]
+                counters['hits'] += 1
+                counters['hit_age'] += now - entry[0]
+            elif (did, key) in self._inflight:
+                waits[key] = self._inflight[(did, key)]
+                counters['coalesced'] += 1
+            else:
+                futures[key] = self._inflight[(did, key)] = asyncio.get_running_loop().create_future()
+                counters['misses'] += 1
+
+        if futures:
+            missing = list(futures)
+            generation = self._generations.get(did, 0)
+            counters['requests'] += 1
+            try:
+                fetched = await fetch(did, missing)
+            except BaseException as e:
+                for future in futures.values():
+                    if isinstance(e, Exception):
+                        future.set_exception(e)
+                        future.exception()  # Mark retrieved when no one else waits
+                    else:
+                        future.cancel()
+                raise
+            finally:
+                for key in missing:
+                    self._inflight.pop((did, key), None)
+            now = time.monotonic()
+            if generation == self._generations.get(did, 0):
+                values = self._values.setdefault(did, {})
+                for key, value in zip(missing, fetched):
+                    values[key] = (now, value)
+            for key, value in zip(missing, fetched):
+                futures[key].set_result(value)
+                results[key] = value
+
+        for key, future in waits.items():
+            results[key] = await future
+        return [results[key] for key in keys]
+
+    async def miot_get_props(self, did, iids):
+        return await self._get(did, [tuple(i[:2]) for i in iids], self.service.miot_get_props)
+
+    async def miot_get_prop(self, did, iid):
+        return (await self.miot_get_props(did, [iid]))[0]
+
+    async def home_get_props(self, did, props):
+        return await self._get(did, props, self.service.home_get_props)
+
+    async def home_get_prop(self, did, prop):
+        return (await self.home_get_props(did, [prop]))[0]
+
+    async def miot_set_props(self, did, props):
+        try:
+            return await self.service.miot_set_props(did, props)
+        finally:
+            self.invalidate(did)
+
+    async def miot_set_prop(self, did, iid, value):
+        return (await self.miot_set_props(did, [(iid[0], iid[1], value)]))[0]
+
+    async def home_set_props(self, did, props, *args, **kwargs):
+        try:
+            return await self.service.home_set_props(did, props, *args, **kwargs)
+        finally:
+            self.invalidate(did)
+
+    async def home_set_prop(self, did, prop, value):
+        try:
+            return await self.service.home_set_prop(did, prop, value)
+        finally:
+            self.invalidate(did)
+
+    async def miot_action(self, did, iid, args=[]):
+        try:
+            return await self.service.miot_action(did, iid, args)
+        finally:
+            self.invalidate(did)
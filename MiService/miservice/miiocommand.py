@@ -1,6 +1,9 @@
 
 import json
-from .miioservice import MiIOService
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .miioservice import MiIOService
 
 
 def twins_split(string, sep, default=None):
@@ -47,10 +50,12 @@ MIoT Spec: {prefix}spec [model_keyword|type_urn] [format=text|python|json]\n\
            {prefix}spec xiaomi.wifispeaker.lx04\n\
            {prefix}spec urn:miot-spec-v2:device:speaker:0000A015:xiaomi-lx04:1\n\n\
 MIoT Decode: {prefix}decode <ssecurity> <nonce> <data> [gzip]\n\
+             {prefix}decode <capture.jsonl|-> [workers]\n\
+             Bulk decode JSON Lines of [ssecurity, nonce, data, gzip], throughput on stderr\n\
 '
 
 
-async def miio_command(service: MiIOService, did, text, prefix='?'):
+async def miio_command(service: 'MiIOService', did, text, prefix='?'):
     cmd, arg = twins_split(text, ' ')
 
     if cmd.startswith('/'):
@@ -68,16 +73,16 @@ async def miio_command(service: MiIOService, did, text, prefix='?'):
         return await service.miot_spec(argc > 0 and argv[0], argc > 1 and argv[1])
 
     if cmd == 'decode':
-        return MiIOService.miot_decode(argv[0], argv[1], argv[2], argc > 3 and argv[3] == 'gzip')
+        from .miiodecode import miot_decode
+        return miot_decode(argv[0], argv[1], argv[2], argc > 3 and argv[3] == 'gzip')
 
     if not did or not cmd or cmd == '?' or cmd == '？' or cmd == 'help' or cmd == '-h' or cmd == '--help':
         return miio_command_help(did, prefix)
 
     if not did.isdigit():
-        devices = await service.device_list(did)
-        if not devices:
-            return "Device not found: " + did
-        did = devices[0]['did']
+        name, did = did, await service.registry.resolve(did)
+        if not did:
+            return "Device not found: " + name
 
     props = []
     setp = True
@@ -0,0 +1,54 @@
+import base64
+import hashlib
+import json
+import os
+import zlib
+from functools import lru_cache
+
+# Captured MIoT responses are RC4 encrypted with sha256(ssecurity + nonce), the first 1024 key stream bytes dropped
+
+
+@lru_cache(maxsize=1024)
+def miot_key(ssecurity, nonce):
+    return hashlib.sha256(base64.b64decode(ssecurity) + base64.b64decode(nonce)).digest()
+
+
+def miot_decode(ssecurity, nonce, data, gzip=False):
+    from Crypto.Cipher import ARC4
+    decrypted = ARC4.new(miot_key(ssecurity, nonce), drop=1024).encrypt(base64.b64decode(data))
+    if gzip:
+        decrypted = zlib.decompress(decrypted, 16 + zlib.MAX_WBITS)
+    return json.loads(decrypted)
+
+
+def miot_record(record):
+    # Capture record: [ssecurity, nonce, data, gzip] or {"ssecurity", "nonce", "data", "gzip"}
+    if isinstance(record, dict):
+        return record['ssecurity'], record['nonce'], record['data'], record.get('gzip', False)
+    return (*record[:3], len(record) > 3 and record[3] in (True, 'gzip'))
+
+
+def _decode_record(record):
+    try:
+        return miot_decode(*miot_record(record))
+    except Exception as e:
+        return Exception(f"{type(e).__name__}: {e}")
+
+
+def miot_decode_many(records, workers=None, chunksize=256):
+    # Yield decoded results in input order, an Exception instance for each undecodable record
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from map(_decode_record, records)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(_decode_record, records, chunksize=chunksize)
+
+
+def miot_capture(lines):
+    # JSON Lines capture file, blank and '#' lines skipped
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield json.loads(line)
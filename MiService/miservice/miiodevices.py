@@ -0,0 +1,132 @@
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_left
+from difflib import get_close_matches
+from .mifile import write_json
+
+_LOGGER = logging.getLogger(__package__)
+
+INDEX_KEYS = ('did', 'name', 'model', 'localip', 'mac')
+
+
+class MiIODeviceRegistry:
+
+    def __init__(self, service, ttl=3600, path=None):
+        self.service = service
+        self.ttl = ttl
+        account = getattr(service, 'account', None)
+        if path is None and getattr(getattr(account, 'token_store', None), 'token_path', None):
+            path = account.token_store.token_path + '.miio'  # Next to the token like the MiNA roster, e.g. ~/.mi.token.miio
+        self.path = path
+        self.devices = {}  # did -> device
+        self.indexes = {key: {} for key in INDEX_KEYS}  # key -> {value: [device, ...]}
+        self._names = []  # Sorted names for prefix lookup
+        self._time = 0
+        self._loaded = False  # Disk copy read
+        self._refreshing = None
+
+    def _index(self, devices):
+        old = self.devices
+        self.devices = {str(d['did']): d for d in devices}
+        indexes = {key: {} for key in INDEX_KEYS}
+        for device in devices:
+            for key in INDEX_KEYS:
+                value = device.get(key)
+                if value:
+                    indexes[key].setdefault(str(value), []).append(device)
+        self.indexes = indexes
+        self._names = sorted(indexes['name'])
+        changed = [did for did, d in self.devices.items() if old.get(did) != d]
+        removed = [did for did in old if did not in self.devices]
+        if old and (changed or removed):
+            _LOGGER.info("Device registry changed=%s removed=%s", changed, removed)
+
+    def _file(self, update=None):
+        # {username: {'time', 'devices'}}, device tokens inside, write_json keeps it owner-only
+        try:
+            with open(self.path) as f:
+                registries = json.load(f)
+        except (OSError, ValueError):
+            registries = {}
+        username = self.service.account.username
+        if update is None:
+            return registries.get(username)
+        registries[username] = update
+        write_json(self.path, registries)
+
+    async def refresh(self):
+        devices = await self.service.device_list('full')
+        self._index(devices)
+        self._time = time.time()
+        if self.path:
+            try:
+                self._file({'time': self._time, 'devices': devices})
+            except OSError as e:
+                _LOGGER.warning("Exception on save device registry to %s: %s", self.path, e)
+        return self.devices
+
+    def _start_refresh(self):
+        # Single-flight: concurrent callers share one device_list request
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self.refresh())
+            self._refreshing.add_done_callback(self._refreshed)
+        return self._refreshing
+
+    def _refreshed(self, task):
+        if not task.cancelled() and task.exception():
+            _LOGGER.warning("Exception on refresh device registry: %s", task.exception())
+
+    async def ensure(self):
+        # Block on the first load, afterwards serve the cached list while refreshing in background
+        if not self._time and not self._loaded and self.path:
+            self._loaded = True
+            saved = self._file()
+            if saved and time.time() - saved['time'] <= self.ttl:
+                self._index(saved['devices'])
+                self._time = saved['time']
+        if not self._time:
+            await asyncio.shield(self._start_refresh())
+        elif time.time() - self._time > self.ttl:
+            self._start_refresh()
+        return self.devices
+
+    def invalidate(self):
+        self._time = 0
+        if self.path:
+            try:
+                self._file({'time': 0, 'devices': []})
+            except OSError:
+                pass
+
+    async def get(self, did):
+        return (await self.ensure()).get(str(did))
+
+    async def lookup(self, key, value):
+        await self.ensure()
+        return self.indexes[key].get(str(value), [])
+
+    async def find(self, name, fuzzy=True):
+        # Exact, prefix, substring, then (if fuzzy) close name matches
+        await self.ensure()
+        by_name = self.indexes['name']
+        if name in by_name:
+            return by_name[name]
+        names = []
+        for i in range(bisect_left(self._names, name), len(self._names)):
+            if not self._names[i].startswith(name):
+                break
+            names.append(self._names[i])
+        names = names or [n for n in self._names if name in n] or (fuzzy and get_close_matches(name, self._names, 3, 0.6)) or []
+        return [d for n in names for d in by_name[n]]
+
+    async def resolve(self, did):
+        if did.isdigit():
+            return did
+        # No fuzzy match here: a command must never go to a device the user did not name
+        devices = await self.find(did, False)
+        if not devices and time.time() - self._time > 60:  # Maybe added or renamed since the cached list
+            await asyncio.shield(self._start_refresh())
+            devices = await self.find(did, False)
+        return str(devices[0]['did']) if devices else None
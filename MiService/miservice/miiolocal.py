@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import logging
+import struct
+import time
+
+_LOGGER = logging.getLogger(__package__)
+
+MIIO_PORT = 54321
+HELLO_PACKET = bytes.fromhex('21310020') + b'\xff' * 28
+
+
+class MiIOCodec:
+    # miIO packet: magic(2) length(2) unknown(4) device_id(4) stamp(4) checksum(16) + AES-128-CBC payload
+
+    def __init__(self, token):
+        from Crypto.Cipher import AES
+        self._aes = AES
+        self.token = bytes.fromhex(token) if isinstance(token, str) else token
+        self.key = hashlib.md5(self.token).digest()
+        self.iv = hashlib.md5(self.key + self.token).digest()
+
+    def encrypt(self, data):
+        pad = 16 - len(data) % 16
+        return self._aes.new(self.key, self._aes.MODE_CBC, self.iv).encrypt(data + bytes([pad]) * pad)
+
+    def decrypt(self, data):
+        data = self._aes.new(self.key, self._aes.MODE_CBC, self.iv).decrypt(data)
+        return data[:-data[-1]]
+
+    def encode(self, device_id, stamp, payload):
+        encrypted = self.encrypt(json.dumps(payload).encode())
+        header = struct.pack('>HHIII', 0x2131, 32 + len(encrypted), 0, device_id, stamp)
+        return header + hashlib.md5(header + self.token + encrypted).digest() + encrypted
+
+    def decode(self, packet):
+        magic, length, _, device_id, stamp = struct.unpack('>HHIII', packet[:16])
+        if magic != 0x2131 or length != len(packet):
+            raise Exception(f"Invalid miIO packet: {packet[:32].hex()}")
+        encrypted = packet[32:]
+        if not encrypted:
+            return device_id, stamp, None  # Hello response
+        if hashlib.md5(packet[:16] + self.token + encrypted).digest() != packet[16:32]:
+            raise Exception("Invalid miIO checksum")
+        return device_id, stamp, json.loads(self.decrypt(encrypted).rstrip(b'\0'))
+
+
+class _MiIOProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._received(data)
+
+    def error_received(self, exc):
+        _LOGGER.debug("miIO %s error: %s", self.client.ip, exc)
+
+
+class MiIOLocal:
+    # Local LAN miIO transport, same MIoT API as MiIOService
+
+    def __init__(self, ip, token, port=MIIO_PORT, timeout=2, retries=3):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.codec = MiIOCodec(token)
+        self.device_id = None
+        self._stamp = None  # (device stamp, local time) from handshake
+        self._transport = None
+        self._hello = None
+        self._lock = None  # Serializes connect + handshake for concurrent callers
+        self._pending = {}  # request id -> future
+        self._id = int(time.time()) % 10000 * 100
+
+    async def _connect(self):
+        if self._transport is None:
+            loop = asyncio.get_running_loop()
+            self._transport, _ = await loop.create_datagram_endpoint(lambda: _MiIOProtocol(self), remote_addr=(self.ip, self.port))
+
+    def close(self):
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+        self._stamp = None
+
+    def _received(self, data):
+        if len(data) == 32:
+            if self._hello and not self._hello.done():
+                self._hello.set_result(data)
+            return
+        try:
+            _, _, payload = self.codec.decode(data)
+        except Exception as e:
+            _LOGGER.warning("Invalid response from %s: %s", self.ip, e)
+            return
+        future = self._pending.pop(payload.get('id'), None)
+        if future and not future.done():
+            future.set_result(payload)
+
+    def _locked(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def handshake(self):
+        async with self._locked():
+            return await self._handshake()
+
+    async def ensure(self):
+        # Single-flight: concurrent first callers share one connect + handshake
+        if self._stamp is None:
+            async with self._locked():
+                if self._stamp is None:
+                    await self._handshake()
+
+    async def _handshake(self):
+        await self._connect()
+        for attempt in range(self.retries):
+            self._hello = asyncio.get_running_loop().create_future()
+            self._transport.sendto(HELLO_PACKET)
+            try:
+                data = await asyncio.wait_for(self._hello, self.timeout)
+            except asyncio.TimeoutError:
+                continue
+            self.device_id, stamp, _ = self.codec.decode(data)
+            self._stamp = (stamp, time.monotonic())
+            return self.device_id
+        raise Exception(f"miIO handshake timeout: {self.ip}")
+
+    async def send(self, method, params=None, resend=True):
+        # resend=False: a request that got no reply is not sent again, the device may have executed it
+        for attempt in range(self.retries):
+            await self.ensure()
+            self._id = self._id % 1000000 + 1
+            request_id = self._id
+            future = self._pending[request_id] = asyncio.get_running_loop().create_future()
+            stamp = self._stamp[0] + int(time.monotonic() - self._stamp[1])
+            self._transport.sendto(self.codec.encode(self.device_id, stamp, {'id': request_id, 'method': method, 'params': params or []}))
+            try:
+                resp = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self._pending.pop(request_id, None)
+                self._stamp = None  # Handshake again, the device may have rebooted
+                if not resend:
+                    raise Exception(f"miIO timeout: {self.ip} {method}, not resent")
+                continue
+            if 'error' in resp:
+                raise Exception(f"miIO error {self.ip} {method}: {resp['error']}")
+            return resp.get('result')
+        raise Exception(f"miIO timeout: {self.ip} {method}")
+
+    async def miot_get_props(self, did, iids):
+        result = await self.send('get_properties', [{'did': str(did), 'siid': i[0], 'piid': i[1]} for i in iids])
+        return [it.get('value') if it.get('code') == 0 else None for it in result]
+
+    async def miot_set_props(self, did, props):
+        result = await self.send('set_properties', [{'did': str(did), 'siid': i[0], 'piid': i[1], 'value': i[2]} for i in props])
+        return [it.get('code', -1) for it in result]
+
+    async def miot_get_prop(self, did, iid):
+        return (await self.miot_get_props(did, [iid]))[0]
+
+    async def miot_set_prop(self, did, iid, value):
+        return (await self.miot_set_props(did, [(iid[0], iid[1], value)]))[0]
+
+    async def miot_action(self, did, iid, args=[], resend=False):
+        result = await self.send('action', {'did': str(did), 'siid': iid[0], 'aiid': iid[1], 'in': args}, resend)
+        return result.get('code', -1)
@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+import logging
+import time
+from .miioservice import MIOT_PROPS_CHUNK
+from .mipolicy import TokenBucket
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class MiIOPoller:
+    # Polls MIoT properties in batched /miotspec/prop/get requests, adapting each interval to how often its value changes
+
+    def __init__(self, service, rate=2.0, batch_window=0.2, backoff=1.5, callback=None):
+        self.service = service
+        self.budget = TokenBucket(rate, 1)  # Global request-rate budget, max requests per second
+        self.batch_window = batch_window  # Also read subscriptions due within this window
+        self.backoff = backoff
+        self.callback = callback
+        self._subs = {}  # (did, (siid, piid)) -> [interval, min, max, value, due]
+        self._queue = []  # (due, did, iid) heap, entries not matching the subscription's due are stale
+        self._events = None  # Created when iterated
+        self._task = None
+        self._wakeup = None
+
+    def subscribe(self, did, iid, min_interval=5, max_interval=300):
+        key = (did, tuple(iid))
+        due = time.monotonic()
+        self._subs[key] = [min_interval, min_interval, max_interval, None, due]
+        heapq.heappush(self._queue, (due, did, key[1]))
+        if self._wakeup:
+            self._wakeup.set()
+
+    def unsubscribe(self, did, iid):
+        self._subs.pop((did, tuple(iid)), None)  # Stale heap entries are skipped when due
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def __aiter__(self):
+        if self._events is None:
+            self._events = asyncio.Queue()
+        self.start()
+        return self
+
+    async def __anext__(self):
+        return await self._events.get()  # (did, (siid, piid), value)
+
+    def _pop_due(self):
+        now = time.monotonic()
+        due = {}
+        while self._queue and self._queue[0][0] <= now + self.batch_window:
+            when, did, iid = heapq.heappop(self._queue)
+            sub = self._subs.get((did, iid))
+            if sub and sub[4] == when:
+                due.setdefault(did, []).append(iid)
+        return due
+
+    async def _run(self):
+        while True:
+            due = self._pop_due()
+            if not due:
+                self._wakeup.clear()
+                timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.budget.acquire(-(-sum(len(iids) for iids in due.values()) // MIOT_PROPS_CHUNK))
+            try:
+                values = await self.service.miot_get_props_many(due)
+            except Exception as e:
+                _LOGGER.warning("Exception on poll %d devices: %s", len(due), e)
+                values = {}
+            now = time.monotonic()
+            for did, iids in due.items():
+                for iid, value in zip(iids, values.get(did, [None] * len(iids))):
+                    sub = self._subs.get((did, iid))
+                    if sub is None:
+                        continue
+                    interval, min_interval, max_interval, last, _ = sub
+                    if value is not None and value != last:
+                        sub[0] = min_interval  # Changing value, poll fast again
+                        sub[3] = value
+                        self._emit(did, iid, value)
+                    else:
+                        sub[0] = min(interval * self.backoff, max_interval)
+                    sub[4] = now + sub[0]
+                    heapq.heappush(self._queue, (sub[4], did, iid))
+
+    def _emit(self, did, iid, value):
+        if self._events is not None:
+            self._events.put_nowait((did, iid, value))
+        if self.callback:
+            try:
+                self.callback(did, iid, value)
+            except Exception as e:
+                _LOGGER.exception("Exception in poll callback: %s", e)
@@ -0,0 +1,107 @@
+import logging
+import time
+import aiohttp
+from .miiolocal import MiIOLocal
+
+_LOGGER = logging.getLogger(__package__)
+
+NOT_SENT = (aiohttp.ClientConnectorError, getattr(aiohttp, 'ConnectionTimeoutError', aiohttp.ClientConnectorError))  # Cloud request failed before it was sent
+
+
+class MiIORouter:
+    # Same MIoT interface as MiIOService: each command goes over LAN when the device answers there, cloud otherwise
+
+    def __init__(self, service, timeout=1, retries=2, cooldown=60, probe_every=20, alpha=0.2):
+        self.service = service
+        self.timeout = timeout
+        self.retries = retries
+        self.cooldown = cooldown  # Seconds to skip a path after it failed
+        self.probe_every = probe_every  # Try the slower or unmeasured path first every N calls
+        self.alpha = alpha  # EWMA weight of the latest latency
+        self.health = {}  # did -> {'calls': n, 'local': PATH, 'cloud': PATH}, PATH = {'latency', 'failures', 'down_until'}
+        self._locals = {}  # did -> MiIOLocal or None
+
+    def __getattr__(self, name):
+        return getattr(self.service, name)
+
+    def close(self):
+        for client in self._locals.values():
+            if client:
+                client.close()
+        self._locals.clear()
+
+    async def _local(self, did):
+        if did not in self._locals:
+            device = await self.service.registry.get(did)
+            ip, token = (device.get('localip'), device.get('token')) if device else (None, None)
+            self._locals[did] = MiIOLocal(ip, token, timeout=self.timeout, retries=self.retries) if ip and token else None
+        return self._locals[did]
+
+    def _update(self, state, elapsed):
+        last = state['latency']
+        state['latency'] = elapsed if last is None else last + self.alpha * (elapsed - last)
+        state['failures'] = 0
+
+    def _fail(self, state):
+        state['failures'] += 1
+        state['down_until'] = time.monotonic() + self.cooldown
+        state['latency'] = None
+
+    def _order(self, health, paths):
+        # Faster measured path first, unmeasured paths after it but first on probe calls; paths in cooldown go last
+        if len(paths) == 1:
+            return paths
+        measured = sorted((p for p in paths if health[p]['latency'] is not None), key=lambda p: health[p]['latency'])
+        order = measured + [p for p in paths if p not in measured]
+        if health['calls'] % self.probe_every == 0:
+            order.reverse()
+        now = time.monotonic()
+        return [p for p in order if now >= health[p]['down_until']] + [p for p in order if now < health[p]['down_until']]
+
+    async def _call(self, did, method, *args, once=False):
+        # once: not safe to run twice (actions), fall back only if nothing was sent on the failed path
+        did = str(did)
+        health = self.health.get(did)
+        if health is None:
+            health = self.health[did] = {'calls': 0, **{p: {'latency': None, 'failures': 0, 'down_until': 0} for p in ('local', 'cloud')}}
+        health['calls'] += 1
+        local = await self._local(did)
+        paths = self._order(health, ['local', 'cloud'] if local else ['cloud'])
+        for i, path in enumerate(paths):
+            start = time.monotonic()
+            sent = False
+            try:
+                if path == 'local':
+                    await local.ensure()  # Connect + handshake, the command itself is not sent yet
+                    sent = True
+                    result = await getattr(local, method)(did, *args, **({'resend': False} if once else {}))
+                else:
+                    sent = True
+                    result = await getattr(self.service, method)(did, *args)
+            except NOT_SENT as e:
+                sent = False
+                error = e
+            except Exception as e:
+                error = e
+            else:
+                self._update(health[path], time.monotonic() - start)
+                return result
+            self._fail(health[path])
+            if i == len(paths) - 1 or (once and sent):
+                raise error
+            _LOGGER.info("%s %s via %s failed, fall back: %s", did, method, path, error)
+
+    async def miot_get_props(self, did, iids):
+        return await self._call(did, 'miot_get_props', iids)
+
+    async def miot_set_props(self, did, props):
+        return await self._call(did, 'miot_set_props', props)
+
+    async def miot_get_prop(self, did, iid):
+        return (await self.miot_get_props(did, [iid]))[0]
+
+    async def miot_set_prop(self, did, iid, value):
+        return (await self.miot_set_props(did, [(iid[0], iid[1], value)]))[0]
+
+    async def miot_action(self, did, iid, args=[]):
+        return await self._call(did, 'miot_action', iid, args, once=True)
@@ -4,22 +4,62 @@ import base64
 import hashlib
 import hmac
 import json
+from .miaccount import limited_gather
+from .mispec import MIOT_SPEC_URL, MiSpecCache
+from .miiodevices import MiIODeviceRegistry
+from .miiodecode import miot_decode
 
 # REGIONS = ['cn', 'de', 'i2', 'ru', 'sg', 'us']
 
+MIOT_PROPS_CHUNK = 100  # Max {did, siid, piid} entries per /miotspec/prop/get request
+IDEMPOTENT_URIS = ('/miotspec/prop/get', '/home/device_list')  # Safe to retry
+
+
+class MiSigner:
+
+    def __init__(self, ssecurity):
+        self.ssecurity = ssecurity
+        self._sha = hashlib.sha256(base64.b64decode(ssecurity))  # Copied per nonce, key is decoded once
+
+    def sign(self, uri, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        elif not isinstance(data, str):
+            data = json.dumps(data)
+        nonce = os.urandom(8) + int(time.time() / 60).to_bytes(4, 'big')
+        m = self._sha.copy()
+        m.update(nonce)
+        snonce = m.digest()
+        nonce = base64.b64encode(nonce).decode()
+        msg = '&'.join([uri, base64.b64encode(snonce).decode(), nonce, 'data=' + data])
+        sign = hmac.new(key=snonce, msg=msg.encode(), digestmod=hashlib.sha256).digest()
+        return {'_nonce': nonce, 'data': data, 'signature': base64.b64encode(sign).decode()}
+
 
 class MiIOService:
 
     def __init__(self, account=None, region=None):
         self.account = account
         self.server = 'https://' + ('' if region is None or region == 'cn' else region + '.') + 'api.io.mi.com/app'
+        self._specs = None
+        self._signer = None
+        self._registry = None
+
+    def signer(self, ssecurity):
+        if self._signer is None or self._signer.ssecurity != ssecurity:
+            self._signer = MiSigner(ssecurity)
+        return self._signer
 
     async def miio_request(self, uri, data):
         def prepare_data(token, cookies):
             cookies['PassportDeviceId'] = token['deviceId']
-            return MiIOService.sign_data(uri, data, token['xiaomiio'][0])
+            start = time.perf_counter()
+            signed = self.signer(token['xiaomiio'][0]).sign(uri, data)
+            self.account.trace('sign', uri=uri, elapsed=time.perf_counter() - start)
+            return signed
         headers = {'User-Agent': 'iOS-14.4-6.0.103-iPhone12,3--D7744744F7AF32F0544445285880DD63E47D9BE9-8816080-84A3F44E137B71AE-iPhone', 'x-xiaomi-protocal-flag-cli': 'PROTOCAL-HTTP2'}
-        resp = await self.account.mi_request('xiaomiio', self.server + uri, prepare_data, headers)
+        idempotent = uri in IDEMPOTENT_URIS or (uri.startswith('/home/rpc/') and isinstance(data, dict) and data.get('method') == 'get_prop')
+        resp = await self.account.mi_request('xiaomiio', self.server + uri, prepare_data, headers, idempotent=idempotent)
         if 'result' not in resp:
             raise Exception(f"Error {uri}: {resp}")
         return resp['result']
@@ -30,8 +70,15 @@ class MiIOService:
     async def home_get_props(self, did, props):
         return await self.home_request(did, 'get_prop', props)
 
-    async def home_set_props(self, did, props):
-        return [await self.home_set_prop(did, i[0], i[1]) for i in props]
+    async def home_set_props(self, did, props, concurrency=1, multi_method=None):
+        if multi_method:  # Device supports setting many props in one RPC, e.g. set_properties
+            result = await self.home_request(did, multi_method, [[i[0], i[1]] for i in props])
+            if result == ['ok']:  # One acknowledgement for the whole batch
+                result = result * len(props)
+            elif not isinstance(result, list) or len(result) != len(props):
+                raise Exception(f"{multi_method} {did}: {len(props)} props, unexpected result {result}")
+            return [0 if r == 'ok' else r for r in result]
+        return await limited_gather([self.home_set_prop(did, i[0], i[1]) for i in props], concurrency)
 
     async def home_get_prop(self, did, prop):
         return (await self.home_get_props(did, [prop]))[0]
@@ -48,6 +95,14 @@ class MiIOService:
         result = await self.miot_request('prop/get', params)
         return [it.get('value') if it.get('code') == 0 else None for it in result]
 
+    async def miot_get_props_many(self, props, chunk_size=MIOT_PROPS_CHUNK, concurrency=4):
+        # {did: [(siid, piid), ...]} -> {did: [value, ...]}, packed into chunked requests sent concurrently
+        params = [{'did': did, 'siid': i[0], 'piid': i[1]} for did, iids in props.items() for i in iids]
+        chunks = [params[i:i + chunk_size] for i in range(0, len(params), chunk_size)]
+        results = await limited_gather([self.miot_request('prop/get', chunk) for chunk in chunks], concurrency)
+        values = {(str(it.get('did')), it.get('siid'), it.get('piid')): it.get('value') for result in results for it in result if it.get('code') == 0}
+        return {did: [values.get((str(did), i[0], i[1])) for i in iids] for did, iids in props.items()}
+
     async def miot_set_props(self, did, props):
         params = [{'did': did, 'siid': i[0], 'piid': i[1], 'value': i[2]} for i in props]
         result = await self.miot_request('prop/set', params)
@@ -68,38 +123,27 @@ class MiIOService:
         result = result['list']
         return result if name == 'full' else [{'name': i['name'], 'model': i['model'], 'did': i['did'], 'token': i['token']} for i in result if not name or name in i['name']]
 
+    @property
+    def registry(self):
+        if self._registry is None:
+            self._registry = MiIODeviceRegistry(self)
+        return self._registry
+
+    @property
+    def specs(self):
+        if self._specs is None:
+            self._specs = MiSpecCache(self.account.session)
+        return self._specs
+
     async def miot_spec(self, type=None, format=None):
         if not type or not type.startswith('urn'):
-            def get_spec(all):
-                if not type:
-                    return all
-                ret = {}
-                for m, t in all.items():
-                    if type == m:
-                        return {m: t}
-                    elif type in m:
-                        ret[m] = t
-                return ret
-            import tempfile
-            path = os.path.join(tempfile.gettempdir(), 'miservice_miot_specs.json')
-            try:
-                with open(path) as f:
-                    result = get_spec(json.load(f))
-            except:
-                result = None
-            if not result:
-                async with self.account.session.get('http://miot-spec.org/miot-spec-v2/instances?status=all') as r:
-                    all = {i['model']: i['type'] for i in (await r.json())['instances']}
-                    with open(path, 'w') as f:
-                        json.dump(all, f)
-                    result = get_spec(all)
+            result = await self.specs.find(type)
             if len(result) != 1:
                 return result
             type = list(result.values())[0]
 
-        url = 'http://miot-spec.org/miot-spec-v2/instance?type=' + type
-        async with self.account.session.get(url) as r:
-            result = await r.json()
+        url = MIOT_SPEC_URL + 'instance?type=' + type
+        result = await self.specs.spec(type)
 
         def parse_desc(node):
             desc = node['description']
@@ -163,21 +207,7 @@ class MiIOService:
 
     @staticmethod
     def miot_decode(ssecurity, nonce, data, gzip=False):
-        from Crypto.Cipher import ARC4
-        r = ARC4.new(base64.b64decode(MiIOService.sign_nonce(ssecurity, nonce)))
-        r.encrypt(bytes(1024))
-        decrypted = r.encrypt(base64.b64decode(data))
-        if gzip:
-            try:
-                from io import BytesIO
-                from gzip import GzipFile
-                compressed = BytesIO()
-                compressed.write(decrypted)
-                compressed.seek(0)
-                decrypted = GzipFile(fileobj=compressed, mode='rb').read()
-            except:
-                pass
-        return json.loads(decrypted.decode())
+        return miot_decode(ssecurity, nonce, data, gzip)
 
     @staticmethod
     def sign_nonce(ssecurity, nonce):
@@ -188,10 +218,4 @@ class MiIOService:
 
     @staticmethod
     def sign_data(uri, data, ssecurity):
-        if not isinstance(data, str):
-            data = json.dumps(data)
-        nonce = base64.b64encode(os.urandom(8) + int(time.time() / 60).to_bytes(4, 'big')).decode()
-        snonce = MiIOService.sign_nonce(ssecurity, nonce)
-        msg = '&'.join([uri, snonce, nonce, 'data=' + data])
-        sign = hmac.new(key=base64.b64decode(snonce), msg=msg.encode(), digestmod=hashlib.sha256).digest()
-        return {'_nonce': nonce, 'data': data, 'signature': base64.b64encode(sign).decode()}
+        return MiSigner(ssecurity).sign(uri, data)
@@ -1,5 +1,7 @@
 import json
-from .miaccount import MiAccount, get_random
+import time
+from .miaccount import MiAccount, get_random, limited_gather
+from .mifile import write_json
 
 import logging
 _LOGGER = logging.getLogger(__package__)
@@ -7,8 +9,14 @@ _LOGGER = logging.getLogger(__package__)
 
 class MiNAService:
 
-    def __init__(self, account: MiAccount):
+    def __init__(self, account: MiAccount, roster_ttl=86400, roster_path=None):
         self.account = account
+        self.server = 'https://api2.mina.mi.com'
+        self.roster_ttl = roster_ttl
+        if roster_path is None and getattr(account.token_store, 'token_path', None):
+            roster_path = account.token_store.token_path + '.mina'  # Next to the token, e.g. ~/.mi.token.mina
+        self.roster_path = roster_path
+        self._roster = None  # (time, devices)
 
     async def mina_request(self, uri, data=None):
         requestId = 'app_ios_' + get_random(30)
@@ -17,12 +25,53 @@ class MiNAService:
         else:
             uri += '&requestId=' + requestId
         headers = {'User-Agent': 'MiHome/6.0.103 (com.xiaomi.mihome; build:6.0.103.1; iOS 14.4.0) Alamofire/6.0.103 MICO/iOSApp/appStore/6.0.103'}
-        return await self.account.mi_request('micoapi', 'https://api2.mina.mi.com' + uri, data, headers)
+        return await self.account.mi_request('micoapi', self.server + uri, data, headers, idempotent=data is None)
 
     async def device_list(self, master=0):
         result = await self.mina_request('/admin/v2/device_list?master=' + str(master))
         return result.get('data') if result else None
 
+    def _roster_file(self, update=None):
+        try:
+            with open(self.roster_path) as f:
+                rosters = json.load(f)
+        except (OSError, ValueError):
+            rosters = {}
+        if update is None:
+            return rosters.get(self.account.username)
+        rosters[self.account.username] = update
+        write_json(self.roster_path, rosters)
+
+    async def devices(self, refresh=False):
+        # Cached device_list, in memory and on disk per account
+        now = time.time()
+        if not refresh:
+            if self._roster is None and self.roster_path:
+                roster = self._roster_file()
+                self._roster = (roster['time'], roster['devices']) if roster else None
+            if self._roster and now - self._roster[0] < self.roster_ttl:
+                return self._roster[1]
+        devices = await self.device_list()
+        if devices is not None:
+            self._roster = (now, devices)
+            if self.roster_path:
+                try:
+                    self._roster_file({'time': now, 'devices': devices})
+                except OSError as e:
+                    _LOGGER.warning("Exception on save roster to %s: %s", self.roster_path, e)
+        return devices
+
+    def invalidate_devices(self):
+        self._roster = None
+        if self.roster_path:
+            try:
+                self._roster_file({'time': 0, 'devices': []})
+            except OSError:
+                pass
+
+    async def find_devices(self, name=None, deviceID=None, capability=None):
+        return [d for d in (await self.devices() or []) if (not deviceID or d['deviceID'] == deviceID) and (not name or name in d.get('name', '')) and (not capability or d.get('capabilities', {}).get(capability))]
+
     async def ubus_request(self, deviceId, method, path, message):
         message = json.dumps(message)
         result = await self.mina_request('/remote/ubus', {'deviceId': deviceId, 'message': message, 'method': method, 'path': path})
@@ -48,3 +97,20 @@ class MiNAService:
                 if devno != -1 or not result:
                     break
         return result
+
+    async def broadcast(self, devices, message, volume=None, concurrency=16):
+        # Fan out to all devices at once, volume then TTS per device; returns per-device results and timings
+        async def send(device):
+            deviceId = device['deviceID']
+            start = time.monotonic()
+            try:
+                result = True if volume is None else await self.player_set_volume(deviceId, volume)
+                if result and message:
+                    result = await self.text_to_speech(deviceId, message)
+                error = None
+            except Exception as e:
+                result, error = False, str(e)
+            if not result:
+                _LOGGER.error("Send to %s failed: %s", deviceId, error or message or volume)
+            return {'deviceID': deviceId, 'name': device.get('name'), 'result': result, 'error': error, 'time': round(time.monotonic() - start, 3)}
+        return await limited_gather([send(device) for device in devices], concurrency)
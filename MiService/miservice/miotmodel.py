@@ -0,0 +1,121 @@
+from collections import namedtuple
+
+MiotProp = namedtuple('MiotProp', 'siid piid format access range values')
+MiotAction = namedtuple('MiotAction', 'siid aiid ins outs')
+
+INT_FORMATS = ('int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64')
+
+
+def urn_name(node):
+    # urn:miot-spec-v2:property:volume:00000013:xiaomi-lx04:1 -> volume
+    parts = node.get('type', '').split(':')
+    return parts[3].replace('-', '_') if len(parts) > 3 else node['description'].lower().replace(' ', '_')
+
+
+class MiotModel:
+
+    def __init__(self, spec):
+        self.type = spec.get('type')
+        self.props = {}  # 'service.property' -> MiotProp
+        self.actions = {}  # 'service.action' -> MiotAction
+        svcs = set()
+        for s in spec['services']:
+            siid = s['iid']
+            svc = urn_name(s)
+            if svc in svcs:
+                svc += '_' + str(siid)
+            svcs.add(svc)
+            for p in s.get('properties', []):
+                values = frozenset(i['value'] for i in p['value-list']) if 'value-list' in p else None
+                prop = MiotProp(siid, p['iid'], p['format'], frozenset(p['access']), tuple(p.get('value-range', ())) or None, values)
+                self.props.setdefault(svc + '.' + urn_name(p), prop)
+            for a in s.get('actions', []):
+                self.actions.setdefault(svc + '.' + urn_name(a), MiotAction(siid, a['iid'], tuple(a['in']), tuple(a['out'])))
+
+    def prop(self, name, access='read'):
+        prop = self.props.get(name)
+        if prop is None:
+            raise Exception(f"Unknown property {name} of {self.type}")
+        if access not in prop.access:
+            raise Exception(f"Property {name} of {self.type} is not {access}able")
+        return prop
+
+    def action(self, name):
+        action = self.actions.get(name)
+        if action is None:
+            raise Exception(f"Unknown action {name} of {self.type}")
+        return action
+
+    def validate(self, name, value):
+        prop = self.prop(name, 'write')
+        format = prop.format
+        if format == 'bool':
+            valid = isinstance(value, bool)
+        elif format in INT_FORMATS:
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        elif format == 'float':
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        elif format == 'string':
+            valid = isinstance(value, str)
+        else:
+            valid = True
+        if valid and prop.values is not None:
+            valid = value in prop.values
+        if valid and prop.range and len(prop.range) > 1:
+            valid = prop.range[0] <= value <= prop.range[1]
+            if valid and len(prop.range) > 2 and format in INT_FORMATS and prop.range[2] > 1:
+                valid = (value - prop.range[0]) % prop.range[2] == 0
+        if not valid:
+            raise Exception(f"Invalid value {value!r} for {name} ({format}, range={prop.range}, values={prop.values})")
+        return prop
+
+
+class MiotRegistry:
+
+    def __init__(self, service):
+        self.service = service
+        self._models = {}  # model -> MiotModel
+        self._dids = {}  # did -> model
+
+    def set_model(self, did, model):
+        self._dids[str(did)] = model
+
+    async def model(self, model):
+        miot_model = self._models.get(model)
+        if miot_model is None:
+            types = await self.service.specs.find(model)
+            if model not in types:
+                raise Exception(f"Unknown model {model}")
+            miot_model = self._models[model] = MiotModel(await self.service.specs.spec(types[model]))
+        return miot_model
+
+    async def device_model(self, did):
+        did = str(did)
+        if did not in self._dids:
+            device = await self.service.registry.get(did)
+            if not device:
+                raise Exception(f"Device not found: {did}")
+            self._dids[did] = device['model']
+        return await self.model(self._dids[did])
+
+    async def get_props(self, did, names):
+        model = await self.device_model(did)
+        props = [model.prop(name) for name in names]
+        return await self.service.miot_get_props(did, [(p.siid, p.piid) for p in props])
+
+    async def set_props(self, did, values):
+        model = await self.device_model(did)
+        props = [(model.validate(name, value), value) for name, value in values.items()]
+        return await self.service.miot_set_props(did, [(p.siid, p.piid, value) for p, value in props])
+
+    async def get(self, did, name):
+        return (await self.get_props(did, [name]))[0]
+
+    async def set(self, did, name, value):
+        return (await self.set_props(did, {name: value}))[0]
+
+    async def action(self, did, name, args=[]):
+        action = (await self.device_model(did)).action(name)
+        if len(args) != len(action.ins):
+            raise Exception(f"Action {name} expects {len(action.ins)} arguments, got {len(args)}")
+        return await self.service.miot_action(did, (action.siid, action.aiid), args)
@@ -0,0 +1,75 @@
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate  # Tokens per second
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._time = time.monotonic()
+
+    def reserve(self, tokens=1):
+        # Take tokens now (possibly going negative) and return how long the caller must wait
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._time) * self.rate) - tokens
+        self._time = now
+        return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    async def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class MiRateLimiter:
+    # Token bucket per host or per sid, e.g. MiRateLimiter(10, 20, {'api2.mina.mi.com': (2, 4)})
+
+    def __init__(self, rate=10, burst=20, rates=None, per='host'):
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.per = per
+        self.buckets = {}
+        self.stats = {}  # key -> {'requests', 'waits', 'wait_time'}
+
+    async def acquire(self, sid, url):
+        key = urlsplit(url).hostname if self.per == 'host' else sid
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(*self.rates.get(key, (self.rate, self.burst)))
+            self.stats[key] = {'requests': 0, 'waits': 0, 'wait_time': 0}
+        stats = self.stats[key]
+        stats['requests'] += 1
+        wait = await bucket.acquire()
+        if wait:
+            stats['waits'] += 1
+            stats['wait_time'] += wait
+        return wait
+
+
+class MiRetryPolicy:
+    # Exponential backoff with full jitter, applied to idempotent requests only
+
+    def __init__(self, retries=3, base=0.5, cap=8, statuses=(429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.statuses = statuses
+        self.stats = {'retries': 0, 'exhausted': 0}
+
+    def should_retry(self, attempt, status):
+        if status is not None and status not in self.statuses:
+            return False  # None: timeout or connection error
+        if attempt >= self.retries:
+            self.stats['exhausted'] += 1
+            return False
+        self.stats['retries'] += 1
+        return True
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
@@ -0,0 +1,110 @@
+import time
+from collections import defaultdict
+from weakref import WeakKeyDictionary
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+
+# Connection caps per Xiaomi host: logins are rare, MIoT calls fan out per device, MiNA broadcasts per speaker
+MI_HOST_LIMITS = {'account.xiaomi.com': 4, 'api.io.mi.com': 32, 'api2.mina.mi.com': 16}
+
+_STATS = WeakKeyDictionary()
+
+
+class MiSessionStats:
+
+    KEYS = ('requests', 'errors', 'connections', 'reused', 'queued', 'queue_wait', 'request_time')
+
+    def __init__(self):
+        self.hosts = defaultdict(lambda: dict.fromkeys(self.KEYS, 0))
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_request_end.append(self._on_request_end)
+        self.trace_config.on_request_exception.append(self._on_request_exception)
+        self.trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        self.trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        self.trace_config.on_connection_queued_start.append(self._on_connection_queued_start)
+        self.trace_config.on_connection_queued_end.append(self._on_connection_queued_end)
+        self.trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        self.trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+
+    async def _on_request_start(self, session, ctx, params):
+        ctx.host = params.url.host
+        ctx.start = time.monotonic()
+        self.hosts[ctx.host]['requests'] += 1
+
+    async def _on_request_end(self, session, ctx, params):
+        self.hosts[ctx.host]['request_time'] += time.monotonic() - ctx.start
+
+    async def _on_request_exception(self, session, ctx, params):
+        self.hosts[ctx.host]['errors'] += 1
+        self.hosts[ctx.host]['request_time'] += time.monotonic() - ctx.start
+
+    async def _on_connection_create_end(self, session, ctx, params):
+        self.hosts[ctx.host]['connections'] += 1  # New TCP/TLS handshake
+
+    async def _on_connection_reuseconn(self, session, ctx, params):
+        self.hosts[ctx.host]['reused'] += 1
+
+    async def _on_connection_queued_start(self, session, ctx, params):
+        ctx.queued = time.monotonic()
+        self.hosts[ctx.host]['queued'] += 1
+
+    async def _on_connection_queued_end(self, session, ctx, params):
+        self.hosts[ctx.host]['queue_wait'] += time.monotonic() - ctx.queued
+
+    async def _on_dns_cache_hit(self, session, ctx, params):
+        self.dns_hits += 1
+
+    async def _on_dns_cache_miss(self, session, ctx, params):
+        self.dns_misses += 1
+
+    def as_dict(self):
+        return {'dns_hits': self.dns_hits, 'dns_misses': self.dns_misses, 'hosts': {h: dict(s) for h, s in self.hosts.items()}}
+
+
+class MiConnector(TCPConnector):
+    # TCPConnector with a connection cap per host name, hosts not in host_limits use limit_per_host (0: none)
+
+    def __init__(self, host_limits=None, limit_per_host=0, **kwargs):
+        self.host_limits = dict(host_limits or {})
+        self.default_per_host = limit_per_host
+        # A non-zero base limit_per_host makes aiohttp track acquired connections per key, the caps are applied below
+        super().__init__(limit_per_host=limit_per_host or (1 if self.host_limits else 0), **kwargs)
+
+    def _available_connections(self, key):
+        # All limit checks and waiter wake-ups of BaseConnector go through here
+        total = self._limit - len(self._acquired) if self._limit else 1
+        host_limit = self.host_limits.get(key.host, self.default_per_host)
+        if not host_limit:
+            return total
+        return min(total, host_limit - len(self._acquired_per_host.get(key, ())))
+
+    def pool(self):
+        # Current occupancy per host: connections in use and idle keep-alive ones
+        hosts = {}
+        for key, acquired in self._acquired_per_host.items():
+            hosts.setdefault(key.host, {'acquired': 0, 'idle': 0, 'limit': self.host_limits.get(key.host, self.default_per_host)})['acquired'] += len(acquired)
+        for key, idle in self._conns.items():
+            hosts.setdefault(key.host, {'acquired': 0, 'idle': 0, 'limit': self.host_limits.get(key.host, self.default_per_host)})['idle'] += len(idle)
+        return {'acquired': len(self._acquired), 'hosts': hosts}
+
+
+def create_session(limit=64, limit_per_host=16, host_limits=MI_HOST_LIMITS, dns_ttl=600, keepalive_timeout=60, timeout=15, connect_timeout=5, **kwargs):
+    # One pool per (host, port, ssl) key, capped by host_limits or limit_per_host; keep-alive avoids repeated TLS handshakes
+    stats = MiSessionStats()
+    connector = MiConnector(host_limits, limit=limit, limit_per_host=limit_per_host, use_dns_cache=True, ttl_dns_cache=dns_ttl, keepalive_timeout=keepalive_timeout)
+    session = ClientSession(connector=connector, timeout=ClientTimeout(total=timeout, connect=connect_timeout), trace_configs=[stats.trace_config] + kwargs.pop('trace_configs', []), **kwargs)
+    _STATS[session] = stats
+    return session
+
+
+def session_stats(session):
+    stats = _STATS.get(session)
+    result = stats.as_dict() if stats else {}
+    connector = session.connector
+    if connector is not None:
+        result.update({'limit': connector.limit, 'limit_per_host': getattr(connector, 'default_per_host', connector.limit_per_host)})
+        if isinstance(connector, MiConnector):
+            result.update({'host_limits': connector.host_limits, 'pool': connector.pool()})
+    return result
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from .mifile import write_json
+
+_LOGGER = logging.getLogger(__package__)
+
+MIOT_SPEC_URL = 'http://miot-spec.org/miot-spec-v2/'
+
+
+class MiSpecCache:
+
+    def __init__(self, session, path=None, ttl=7 * 86400, spec_ttl=30 * 86400, lru_size=64, retry_after=300):
+        self.session = session
+        self.path = path or os.path.join(tempfile.gettempdir(), 'miservice_miot_specs')
+        self.ttl = ttl
+        self.spec_ttl = spec_ttl
+        self.lru_size = lru_size
+        self.retry_after = retry_after  # Seconds before a failed refresh is tried again
+        self._models = None  # model -> type
+        self._sorted = None  # Sorted models for prefix lookup
+        self._expires = 0
+        self._specs = OrderedDict()  # type -> spec, in LRU order
+
+    def _file(self, name):
+        return os.path.join(self.path, name.replace(':', '_') + '.json')
+
+    def _read(self, name):
+        try:
+            with open(self._file(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, name, cache):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            write_json(self._file(name), cache)
+        except OSError as e:
+            _LOGGER.warning("Exception on save spec cache %s: %s", name, e)
+
+    def _index(self, models, expires):
+        self._models = models
+        self._sorted = sorted(models)
+        self._expires = expires
+
+    async def models(self):
+        now = time.time()
+        if self._models is not None and now < self._expires:
+            return self._models
+        cache = self._read('instances')
+        if cache and now < cache['time'] + self.ttl:
+            self._index(cache['models'], cache['time'] + self.ttl)
+            return self._models
+        try:
+            async with self.session.get(MIOT_SPEC_URL + 'instances?status=all') as r:
+                models = {i['model']: i['type'] for i in (await r.json())['instances']}
+            self._write('instances', {'time': now, 'models': models})
+            self._index(models, now + self.ttl)
+        except Exception as e:
+            if not cache:
+                raise
+            _LOGGER.warning("Exception on update spec instances, using stale cache: %s", e)
+            self._index(cache['models'], now + self.retry_after)  # Stale, revalidate soon
+        return self._models
+
+    async def find(self, keyword=None):
+        models = await self.models()
+        if not keyword:
+            return models
+        if keyword in models:
+            return {keyword: models[keyword]}
+        ret = {}
+        sorted_models = self._sorted
+        for i in range(bisect_left(sorted_models, keyword), len(sorted_models)):
+            if not sorted_models[i].startswith(keyword):
+                break
+            ret[sorted_models[i]] = models[sorted_models[i]]
+        return ret or {m: t for m, t in models.items() if keyword in m}
+
+    async def spec(self, type):
+        spec = self._specs.get(type)
+        if spec is not None:
+            self._specs.move_to_end(type)
+            return spec
+
+        now = time.time()
+        cache = self._read(type)
+        if cache and now < cache['time'] + self.spec_ttl:
+            spec = cache['spec']
+        else:
+            headers = {'If-None-Match': cache['etag']} if cache and cache.get('etag') else None
+            try:
+                async with self.session.get(MIOT_SPEC_URL + 'instance?type=' + type, headers=headers) as r:
+                    if r.status == 304:
+                        spec = cache['spec']
+                    else:
+                        spec = await r.json()
+                        cache = {'etag': r.headers.get('ETag'), 'spec': spec}
+                cache['time'] = now
+                self._write(type, cache)
+            except Exception as e:
+                if not cache:
+                    raise
+                _LOGGER.warning("Exception on update spec %s, using stale cache: %s", type, e)
+                spec = cache['spec']
+
+        self._specs[type] = spec
+        if len(self._specs) > self.lru_size:
+            self._specs.popitem(last=False)
+        return spec
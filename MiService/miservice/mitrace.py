@@ -0,0 +1,100 @@
+import logging
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+_LOGGER = logging.getLogger(__package__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def endpoint(url):
+    # https://api.io.mi.com/app/home/rpc/267090026 -> api.io.mi.com/app/home/rpc/:id
+    parts = urlsplit(url)
+    return parts.hostname + re.sub(r'/\d+(?=/|$)', '/:id', parts.path)
+
+
+def braces(labels):
+    labels = labels.rstrip(',')
+    return '{' + labels + '}' if labels else ''
+
+
+class MiTracer:
+    # Hook surface: request_start, request_end, login, relogin, sign, decode events with keyword fields
+
+    def __init__(self, *hooks):
+        self.hooks = list(hooks)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def emit(self, event, **fields):
+        for hook in self.hooks:
+            try:
+                hook(event, fields)
+            except Exception as e:
+                _LOGGER.exception("Exception in trace hook %s: %s", hook, e)
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def export(self, name, labels):
+        lines = []
+        cumulative = 0
+        for le, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{braces(labels)} {self.sum}')
+        lines.append(f'{name}_count{braces(labels)} {self.count}')
+        return lines
+
+
+class MiMetrics:
+    # Trace hook aggregating latency histograms and counters, exported in Prometheus text format
+
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)  # (name, labels) -> Histogram
+        self.counters = defaultdict(int)  # (name, labels) -> value
+
+    def __call__(self, event, fields):
+        if event == 'request_end':
+            labels = f'endpoint="{endpoint(fields["url"])}",'
+            self.histograms[('miservice_request_seconds', labels)].observe(fields['elapsed'])
+            self.counters[('miservice_response_bytes_total', labels)] += fields.get('size') or 0
+            self.counters[('miservice_retries_total', labels)] += fields.get('attempts', 1) - 1
+            if fields.get('status') != 200 or fields.get('code'):
+                self.counters[('miservice_request_errors_total', labels + f'status="{fields.get("status")}",code="{fields.get("code")}",')] += 1
+        elif event == 'login':
+            labels = f'sid="{fields["sid"]}",ok="{fields["ok"]}",'
+            self.histograms[('miservice_login_seconds', labels)].observe(fields['elapsed'])
+        elif event == 'relogin':
+            self.counters[('miservice_relogin_total', f'sid="{fields["sid"]}",')] += 1
+        elif event in ('sign', 'decode'):
+            self.histograms[(f'miservice_{event}_seconds', '')].observe(fields['elapsed'])
+
+    def export(self):
+        lines = []
+        for kind, items in (('histogram', self.histograms), ('counter', self.counters)):
+            names = sorted(set(name for name, _ in items))
+            for name in names:
+                lines.append(f'# TYPE {name} {kind}')
+                for (n, labels), value in sorted(items.items()):
+                    if n != name:
+                        continue
+                    if kind == 'histogram':
+                        lines.extend(value.export(name, labels))
+                    else:
+                        lines.append(f'{name}{braces(labels)} {value}')
+        return '\n'.join(lines) + '\n'
@@ -1,5 +1,5 @@
+import asyncio
 import socket
-import time
 import struct
 import logging
 import argparse
@@ -25,82 +25,78 @@ class MiioDiscovery:
         packet.extend([0xff] * 28)  # Fill with 0xFF
         return bytes(packet)
     
-    def discover(self, timeout=10):
+    def discover(self, timeout=10, targets=()):
         """Discover devices on the network"""
         print(f"Starting discovery (timeout: {timeout}s)...")
-        
-        # Focus on the known working interface
-        target_interface = '192.168.1.5'
-        target_device = '192.168.1.45'
-        
-        print(f"Using interface: {target_interface}")
-        print(f"Target device: {target_device}")
-        
+        return asyncio.run(self.discover_all(timeout, targets))
+
+    async def discover_all(self, timeout=10, targets=()):
+        """Collect devices from discover_async, keyed by IP"""
         devices = {}
-        
-        try:
-            # Create socket
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            sock.settimeout(2.0)
-            
-            try:
-                # Bind to the specific interface
-                sock.bind((target_interface, 0))
-                _, port = sock.getsockname()
-                print(f"Bound to {target_interface}:{port}")
-                
-                # Create discovery packet
-                packet = self.create_discovery_packet()
-                
-                start_time = time.time()
-                while (time.time() - start_time) < timeout:
-                    try:
-                        # Try both broadcast and direct
-                        print("\nSending discovery packets...")
-                        sock.sendto(packet, ('255.255.255.255', self.port))
-                        sock.sendto(packet, (target_device, self.port))
-                        
-                        # Try to receive multiple times
-                        receive_until = time.time() + 2.0
-                        while time.time() < receive_until:
-                            try:
-                                data, addr = sock.recvfrom(1024)
-                                print(f"Received response from {addr}")
-                                
-                                if len(data) >= 32:
-                                    device_info = self.parse_response(data, addr)
-                                    if device_info and self.is_valid_device(device_info):
-                                        devices[addr[0]] = device_info
-                                        print(f"\nFound device at {addr[0]}:")
-                                        print(f"  * Device ID: {device_info['device_id']}")
-                                        print(f"  * Device Type: {device_info['device_type']}")
-                                        print(f"  * Response: {device_info['raw_response']}")
-                                        
-                                        if device_info['device_id'] == '08f83588':
-                                            print("Found target device!")
-                                            return devices
-                                            
-                            except socket.timeout:
-                                continue
-                                
-                    except Exception as e:
-                        print(f"Error during discovery: {e}")
-                    
-                    time.sleep(1)  # Wait before next attempt
-                    
-            finally:
-                sock.close()
-                
-        except Exception as e:
-            print(f"Error setting up socket: {e}")
-        
+        async for device_info in self.discover_async(timeout, targets):
+            devices[device_info['ip']] = device_info
+            print(f"\nFound device at {device_info['ip']}:")
+            print(f"  * Device ID: {device_info['device_id']}")
+            print(f"  * Device Type: {device_info['device_type']}")
         if not devices:
             print("No devices found")
-        
         return devices
-    
+
+    async def discover_async(self, timeout=10, targets=(), schedule=(0, 0.1, 0.3, 0.7, 1.5, 3)):
+        """Broadcast hello on all local interfaces concurrently, yield each device once as it answers"""
+        loop = asyncio.get_running_loop()
+        responses = asyncio.Queue()
+        packet = self.create_discovery_packet()
+        interfaces = [ip for ip in self.get_local_ips() if self.interface in ('0.0.0.0', ip)] or [self.interface]
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                responses.put_nowait((data, addr))
+
+        transports = []
+        for ip in interfaces:
+            try:
+                transport, _ = await loop.create_datagram_endpoint(Protocol, local_addr=(ip, 0), allow_broadcast=True)
+                transports.append(transport)
+                logging.debug("Bound to %s:%s", *transport.get_extra_info('sockname')[:2])
+            except OSError as e:
+                logging.debug("Skip interface %s: %s", ip, e)
+
+        async def broadcast(transport):
+            # Backoff schedule: dense at first for fast answers, sparse later for slow devices
+            start = loop.time()
+            for offset in schedule:
+                if offset >= timeout:
+                    break
+                await asyncio.sleep(max(0, start + offset - loop.time()))
+                for addr in ('255.255.255.255',) + tuple(targets):
+                    try:
+                        transport.sendto(packet, (addr, self.port))
+                    except OSError as e:
+                        logging.debug("Send to %s failed: %s", addr, e)
+
+        senders = [asyncio.ensure_future(broadcast(t)) for t in transports]
+        deadline = loop.time() + timeout
+        seen = set()
+        try:
+            while transports:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    data, addr = await asyncio.wait_for(responses.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                device_info = self.parse_response(data, addr)
+                if device_info and self.is_valid_device(device_info) and device_info['device_id'] not in seen:
+                    seen.add(device_info['device_id'])
+                    yield device_info
+        finally:
+            for sender in senders:
+                sender.cancel()
+            for transport in transports:
+                transport.close()
+
     def parse_response(self, data, addr):
         """Parse device response"""
         if len(data) < 32:
@@ -166,27 +162,22 @@ class MiioDiscovery:
         except Exception as e:
             print(f"Error getting interfaces: {e}")
         
-        # Add known good interfaces
-        ips.update([
-            '192.168.1.5',    # Your local IP
-            '172.25.80.1'     # Another interface
-        ])
-        
         # Filter out localhost and invalid IPs
         return [ip for ip in ips if not ip.startswith('127.') and ip != '0.0.0.0']
 
 def main():
     parser = argparse.ArgumentParser(description='Discover Xiaomi devices')
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
-    parser.add_argument('--timeout', type=int, default=10, help='Discovery timeout in seconds')
+    parser.add_argument('--timeout', type=float, default=1.5, help='Discovery deadline in seconds')
     parser.add_argument('--interface', default='0.0.0.0', help='Network interface to use')
+    parser.add_argument('--target', action='append', default=[], help='Also send hello directly to this IP')
     args = parser.parse_args()
     
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
     
     discovery = MiioDiscovery(interface=args.interface)
-    devices = discovery.discover(timeout=args.timeout)
+    devices = discovery.discover(timeout=args.timeout, targets=args.target)
     
     if not devices:
         print("No devices found")